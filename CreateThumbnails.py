@@ -1,16 +1,23 @@
 import logging
 import os
+import queue
+from billiard import Pool  # 与 multiprocessing 不同，可以在 Celery prefork 的守护子进程中创建进程池
 from PIL import Image
 from tqdm import tqdm
 import hashlib
+from config import HASH_READ_SIZE, THUMBNAIL_WORKERS, THUMBNAIL_MAX_IN_FLIGHT, THUMBNAIL_MAX_EDGE, RENDITION_SIZES
+from hash_cache import file_hash
 
 # 设置Pillow库的图像大小限制
 Image.MAX_IMAGE_PIXELS = None  # 或者设置为一个足够大的数值
 
-# 指定压缩质量参数
-JPEG_QUALITY = 20
+# 指定压缩质量参数（压缩图已缩小尺寸，不再需要极低的质量来减小体积）
+JPEG_QUALITY = 75
 PNG_COMPRESSION_LEVEL = 9  # PNG压缩级别，0-9，9为最高压缩
 
+# 首页使用的压缩图对应的尺寸名称，其路径即 image_compression_index.compressed_path
+GRID_RENDITION = 'grid'
+
 # 获取当前工作目录
 current_dir = os.getcwd()
 
@@ -28,11 +35,14 @@ def calculate_file_hash(file_path, hash_algorithm='sha256'):
         str: 文件的哈希值。
     """
     try:
+        # SHA-256 通过共享的哈希缓存获取，同一文件只读取一次
+        if hash_algorithm == 'sha256':
+            return file_hash(file_path)
         # 创建指定算法的哈希对象
         hash_func = hashlib.new(hash_algorithm)
         # 以二进制方式打开文件并计算哈希值
         with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(4096), b''):
+            for chunk in iter(lambda: f.read(HASH_READ_SIZE), b''):
                 hash_func.update(chunk)
         # 返回哈希值的十六进制表示
         return hash_func.hexdigest()
@@ -41,22 +51,72 @@ def calculate_file_hash(file_path, hash_algorithm='sha256'):
         return None
 
 
+# 按原图格式的压缩参数保存图片
+def save_compressed(img, output_path, image_format):
+    # 如果图片是JPEG格式，调整质量参数
+    if image_format == 'JPEG':
+        img.save(output_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    # 如果图片是PNG格式，调整压缩级别
+    elif image_format == 'PNG':
+        img.save(output_path, 'PNG', compress_level=PNG_COMPRESSION_LEVEL, optimize=True)
+    # 对于GIF格式，尝试减少颜色数量
+    elif image_format == 'GIF':
+        img.save(output_path, 'GIF', optimize=True, colors=256)
+    # 对于其他格式，尝试使用默认参数保存
+    else:
+        img.save(output_path)
+
+
+# 将已打开的图片对象缩小到最长边不超过 max_edge 并压缩保存到 output_path
+def compress_opened_image(img, output_path, max_edge=THUMBNAIL_MAX_EDGE):
+    image_format = img.format
+    # JPEG 在解码时直接按 1/2、1/4、1/8 缩放，大图不需要完整解码
+    if image_format == 'JPEG':
+        img.draft(img.mode, (max_edge, max_edge))
+    # 其余格式由 thumbnail 先用 reduce 粗缩再重采样
+    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    save_compressed(img, output_path, image_format)
+
+
+# 从一次解码生成所有尺寸的版本
+def create_renditions(img, image_path):
+    """
+    按 RENDITION_SIZES 从大到小依次缩小同一个图片对象，生成多尺寸版本。
+
+    JPEG 只按最大尺寸做一次缩放解码；比原图更大的尺寸不重复生成，
+    原图小于某一尺寸时，该尺寸使用原图分辨率，更大的尺寸直接跳过。
+
+    参数:
+        img (PIL.Image.Image): 已打开、尚未解码的图片对象。
+        image_path (str): 原图路径。
+
+    返回:
+        list: 每个元素是 (尺寸名称, 文件路径, 宽, 高) 的元组。
+    """
+    image_format = img.format
+    source_edge = max(img.size)
+    sizes = sorted(RENDITION_SIZES.items(), key=lambda item: item[1], reverse=True)
+    if image_format == 'JPEG':
+        img.draft(img.mode, (sizes[0][1], sizes[0][1]))
+
+    renditions = []
+    for index, (name, max_edge) in enumerate(sizes):
+        # 若原图不比下一档更大，这一档与下一档相同，无需生成
+        smaller_edge = sizes[index + 1][1] if index + 1 < len(sizes) else 0
+        if name != GRID_RENDITION and source_edge <= smaller_edge:
+            continue
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        output_path = get_rendition_path(image_path, name)
+        save_compressed(img, output_path, image_format)
+        renditions.append((name, output_path, img.width, img.height))
+    return renditions
+
+
 # 压缩图片并保存
 def compress_image(image_path, output_path):
     try:
         with Image.open(image_path) as img:
-            # 如果图片是JPEG格式，调整质量参数
-            if img.format == 'JPEG':
-                img.save(output_path, 'JPEG', quality=JPEG_QUALITY)
-            # 如果图片是PNG格式，调整压缩级别
-            elif img.format == 'PNG':
-                img.save(output_path, 'PNG', compress_level=PNG_COMPRESSION_LEVEL, optimize=True)
-            # 对于GIF格式，尝试减少颜色数量
-            elif img.format == 'GIF':
-                img.save(output_path, 'GIF', optimize=True, colors=256)
-            # 对于其他格式，尝试使用默认参数保存
-            else:
-                img.save(output_path)
+            compress_opened_image(img, output_path)
             logging.info(f"压缩图像从 {image_path} 到 {output_path}")
     except Exception as e:
         # 捕获异常并返回错误信息
@@ -88,13 +148,155 @@ def get_folder_from_txt(txt_path):
         return None
 
 
+# 根据原图路径生成压缩图路径，保存到 'compressed/最后一级文件夹'，并确保目录存在
+def get_compressed_path(image_path):
+    # 获取源文件的最后一级目录名
+    src_dir_name = os.path.basename(os.path.dirname(image_path))
+
+    # 创建压缩图的目录路径，保存到 'compressed/最后一级文件夹'
+    compressed_dir_path = os.path.join(current_dir, 'compressed', src_dir_name)
+
+    # 确保压缩图目录存在
+    os.makedirs(compressed_dir_path, exist_ok=True)
+
+    # 获取文件的扩展名
+    base_name, ext = os.path.splitext(os.path.basename(image_path))
+    # 创建压缩图的文件名，并返回压缩图的完整路径
+    return os.path.join(compressed_dir_path, f"{base_name}_compressed{ext}")
+
+
+# 本进程复用的常驻进程池，由 configure_pool 在 worker 进程启动时创建
+_shared_pool = None
+_shared_workers = None
+
+
+def configure_pool(workers):
+    """
+    设置本进程生成压缩图使用的进程数，大于 1 时创建常驻进程池，之后的 map_bounded 调用都复用它。
+
+    在 Celery worker 子进程启动时调用一次，避免每个分块任务都创建和销毁进程池。
+
+    参数:
+        workers (int): 进程数，为 1 时在当前进程内逐张处理。
+    """
+    global _shared_pool, _shared_workers
+    shutdown_pool()
+    _shared_workers = workers
+    if workers > 1:
+        _shared_pool = Pool(processes=workers)
+
+
+# 关闭常驻进程池（worker 进程退出时调用）
+def shutdown_pool():
+    global _shared_pool
+    if _shared_pool is not None:
+        _shared_pool.terminate()
+        _shared_pool = None
+
+
+# 在进程池中并行执行任务，限制同时提交的任务数量
+def map_bounded(func, items, workers=None, max_in_flight=None):
+    """
+    在进程池中对每个元素执行 func，按完成顺序逐个返回结果。
+
+    同时提交的任务不超过 max_in_flight 个，处理大批量图片时内存占用保持平稳。
+    func 必须是模块级函数；单个任务抛出的异常作为结果返回，不影响其他任务。
+    进程池使用 billiard，在 Celery worker 的任务中调用时同样并行执行。
+
+    参数:
+        func (callable): 对单个元素执行的函数。
+        items (iterable): 待处理的元素。
+        workers (int): 进程数，默认为 configure_pool 设置的值，未设置时为 THUMBNAIL_WORKERS；为 1 时在当前进程内执行。
+        max_in_flight (int): 同时提交的最大任务数，默认为 THUMBNAIL_MAX_IN_FLIGHT。
+
+    返回:
+        generator: 每个元素是 (输入元素, 结果或异常) 的元组。
+    """
+    workers = workers or _shared_workers or THUMBNAIL_WORKERS
+    max_in_flight = max(max_in_flight or THUMBNAIL_MAX_IN_FLIGHT, workers)
+
+    if workers <= 1:
+        for item in items:
+            try:
+                yield item, func(item)
+            except Exception as e:
+                yield item, e
+        return
+
+    if _shared_pool is not None and workers == _shared_workers:
+        yield from _map_in_pool(_shared_pool, func, items, max_in_flight)
+        return
+    with Pool(processes=workers) as pool:
+        yield from _map_in_pool(pool, func, items, max_in_flight)
+        pool.close()
+        pool.join()
+
+
+# 向进程池提交任务，同时提交的任务不超过 max_in_flight 个；结果由进程池的回调线程放入队列，按完成顺序取出
+def _map_in_pool(pool, func, items, max_in_flight):
+    results = queue.Queue()
+    in_flight = 0
+    for item in items:
+        if in_flight >= max_in_flight:
+            yield results.get()
+            in_flight -= 1
+        pool.apply_async(func, (item,),
+                         callback=lambda result, item=item: results.put((item, result)),
+                         error_callback=lambda error, item=item: results.put((item, _task_exception(error))))
+        in_flight += 1
+    while in_flight:
+        yield results.get()
+        in_flight -= 1
+
+
+# billiard 以 ExceptionInfo 传递任务中抛出的异常，取出原始异常对象
+def _task_exception(error):
+    return getattr(error, 'exception', error)
+
+
+# 压缩单张图片并计算原图哈希值，供进程池调用
+def compress_and_hash(image_path):
+    """
+    压缩单张图片并计算原始文件的哈希值。
+
+    参数:
+        image_path (str): 原图路径。
+
+    返回:
+        tuple: (原始文件哈希值, 压缩图片路径)；出错时返回错误信息字符串。
+    """
+    # 创建压缩图的完整路径
+    compressed_path = get_compressed_path(image_path)
+
+    # 压缩图片
+    error = compress_image(image_path, compressed_path)
+    if error:
+        return error
+
+    # 计算原始图片文件内容的哈希值
+    image_hash = calculate_file_hash(image_path)
+    if image_hash is None:
+        return f"跳过文件 {image_path}，因为哈希计算失败。"
+    return image_hash, compressed_path
+
+
+# 根据原图路径生成指定尺寸版本的路径，grid 版本即压缩图路径
+def get_rendition_path(image_path, name):
+    compressed_path = get_compressed_path(image_path)
+    if name == GRID_RENDITION:
+        return compressed_path
+    base_name, ext = os.path.splitext(os.path.basename(image_path))
+    return os.path.join(os.path.dirname(compressed_path), f"{base_name}_{name}{ext}")
+
+
 # 创建所有图片的压缩版本
-def create_compressed_images(directory):
+def create_compressed_images(directory, workers=None):
     """
     创建所有图片的压缩版本，并返回原始文件的哈希值和压缩图片路径的列表。
 
     参数:
         directory (str): 包含图片的根目录。
+        workers (int): 并行压缩的进程数，默认为 THUMBNAIL_WORKERS。
 
     返回:
         list: 每个元素是 (原始文件哈希值, 压缩图片路径) 的元组。
@@ -110,40 +312,18 @@ def create_compressed_images(directory):
         from GetPath import get_image_paths  # 确保 get_image_paths 从正确的模块导入
         image_paths = get_image_paths(max_subfolder_path)
         compressed_images = []
-        for image_path in tqdm(image_paths, desc="Compressing images", unit="image"):
-            # 获取源文件的最后一级目录名
-            src_dir_name = os.path.basename(os.path.dirname(image_path))
-
-            # 创建压缩图的目录路径，保存到 'compressed/最后一级文件夹'
-            compressed_dir_path = os.path.join(current_dir, 'compressed', src_dir_name)
-
-            # 确保压缩图目录存在
-            os.makedirs(compressed_dir_path, exist_ok=True)
-
-            # 获取文件的扩展名
-            _, ext = os.path.splitext(os.path.basename(image_path))
-            # 创建压缩图的文件名
-            compressed_file_name = f"{os.path.splitext(os.path.basename(image_path))[0]}_compressed{ext}"
-            # 创建压缩图的完整路径
-            compressed_path = os.path.join(compressed_dir_path, compressed_file_name)
-
-            # 压缩图片
-            error = compress_image(image_path, compressed_path)
-            if error:
-                logging.info(error)  # 打印错误信息
+        results = map_bounded(compress_and_hash, image_paths, workers)
+        for image_path, result in tqdm(results, total=len(image_paths), desc="Compressing images", unit="image"):
+            if not isinstance(result, tuple):
+                logging.info(f"Error processing {image_path}: {result}" if isinstance(result, Exception) else result)
                 continue  # 跳过当前错误，继续处理下一个图片
 
-            # 计算原始图片文件内容的哈希值
-            image_hash = calculate_file_hash(image_path)
-            if image_hash is None:
-                logging.info(f"跳过文件 {image_path}，因为哈希计算失败。")
-                continue  # 跳过当前错误
-
             # 将哈希值和压缩图片路径添加到结果列表
-            compressed_images.append((image_hash, compressed_path))
+            compressed_images.append(result)
         return compressed_images
 
 
-# 指定你的 images 根目录路径
-images_dir = 'images'  # 替换为你的实际路径
-compressed_images = create_compressed_images(images_dir)
\ No newline at end of file
+if __name__ == '__main__':
+    # 指定你的 images 根目录路径
+    images_dir = 'images'  # 替换为你的实际路径
+    compressed_images = create_compressed_images(images_dir)
\ No newline at end of file
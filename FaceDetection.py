@@ -6,6 +6,7 @@ from mysql.connector import Error
 from tqdm import tqdm
 import logging
 from config import db_config
+from image_keys import to_key
 from datetime import datetime
 
 
@@ -31,10 +32,6 @@ def setup_logging():
     return logger
 
 
-# 设置日志记录
-logging = setup_logging()
-
-
 # 连接到MySQL数据库
 def connect_to_db():
     try:
@@ -90,7 +87,7 @@ def create_table(conn):
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS face_detection_index (
-            id CHAR(64) NOT NULL,
+            id BINARY(32) NOT NULL,
             num_faces INT,
             last_run_time DATETIME,
             PRIMARY KEY (id)
@@ -106,7 +103,7 @@ def add_face_detection_to_db(image_hash, num_faces, conn, last_run_time):
     cursor.execute('''
         INSERT INTO face_detection_index (id, num_faces, last_run_time) VALUES (%s, %s, %s)
         ON DUPLICATE KEY UPDATE num_faces = VALUES(num_faces), last_run_time = VALUES(last_run_time)
-    ''', (image_hash, num_faces, last_run_time))
+    ''', (to_key(image_hash), num_faces, last_run_time))
     conn.commit()
     log_to_db(conn, "INFO", f"Inserted {num_faces} faces data into database for image {image_hash} at {last_run_time}.")
 
@@ -145,7 +142,7 @@ def main():
 
                 # 检查图片是否自上次运行以来被修改过
                 cursor = conn.cursor()
-                cursor.execute('SELECT last_run_time FROM face_detection_index WHERE id = %s', (image_hash,))
+                cursor.execute('SELECT last_run_time FROM face_detection_index WHERE id = %s', (to_key(image_hash),))
                 result = cursor.fetchone()
 
                 # 修改此处：直接比较 datetime 对象
@@ -161,4 +158,6 @@ def main():
 
 
 if __name__ == "__main__":
+    # 设置日志记录
+    setup_logging()
     main()
@@ -1,5 +1,6 @@
 import logging
 import os
+from datetime import datetime
 from PIL import Image
 from PIL.ExifTags import TAGS
 import hashlib
@@ -8,6 +9,11 @@ from mysql.connector import Error
 
 from CreateThumbnails import calculate_file_hash
 from config import db_config
+from bulk_writer import BulkWriter
+from image_keys import to_key
+
+# 读取EXIF信息的图片格式
+exif_extensions = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
 
 # 连接到MySQL数据库
 def connect_to_db():
@@ -18,25 +24,39 @@ def connect_to_db():
         logging.info("连接 MySQL 时出错", e)
         return None
 
+# 从已打开的图片对象中读取EXIF信息，不会触发像素解码
+def extract_exif(img):
+    exif_data = {}
+    getexif = getattr(img, '_getexif', None)
+    exif = getexif() if getexif else None
+    if exif is not None:
+        for tag, value in exif.items():
+            tag_name = TAGS.get(tag, tag)
+            exif_data[tag_name] = value
+    return exif_data
+
 # 获取图片的EXIF信息
 def get_exif_data(image_path):
     exif_data = {}
     try:
         with Image.open(image_path) as img:
-            exif = img._getexif()
-            if exif is not None:
-                for tag, value in exif.items():
-                    tag_name = TAGS.get(tag, tag)
-                    exif_data[tag_name] = value
+            exif_data = extract_exif(img)
     except Exception as e:
         logging.info(f"为以下设备获取 EXIF 数据时出错 {image_path}: {e}")
     return exif_data
 
 # 获取拍摄时间
+# 相机未设置时间时写入 "0000:00:00 00:00:00"，这类值和格式不正确的值返回 None
 def get_capture_time(exif_data):
-    if 'DateTimeOriginal' in exif_data:
-        return exif_data['DateTimeOriginal']
-    return None
+    value = exif_data.get('DateTimeOriginal')
+    if isinstance(value, bytes):
+        value = value.decode('ascii', 'ignore')
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
 
 # 获取GPS信息
 def get_gps_info(exif_data):
@@ -54,23 +74,30 @@ def get_gps_info(exif_data):
             gps_info['GPSCoordinates'] = f"{lat_ref} {lat[0]}/{lat[1]}/{lat[2]}, {lng_ref} {lng[0]}/{lng[1]}/{lng[2]}"
     return gps_info
 
-# 将EXIF信息添加到数据库
-def add_exif_to_db(image_hash, exif_data, conn):
-    cursor = conn.cursor()
+# 提取需要入库的EXIF字段：(拍摄时间, GPS坐标)
+def summarize_exif(exif_data):
+    return get_capture_time(exif_data), get_gps_info(exif_data).get('GPSCoordinates')
+
+# 创建 image_exif_index 表（如果不存在）
+def create_exif_table(cursor):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS image_exif_index (
-            id CHAR(64) NOT NULL,
+            id BINARY(32) NOT NULL,
             capture_time DATETIME,
             gps_info TEXT,
             PRIMARY KEY (id)
         )
     ''')
-    capture_time = get_capture_time(exif_data)
-    gps_info = get_gps_info(exif_data)
-    cursor.execute('''
-        INSERT INTO image_exif_index (id, capture_time, gps_info) VALUES (%s, %s, %s)
-    ''', (image_hash, capture_time, gps_info.get('GPSCoordinates')))
-    conn.commit()
+
+# 批量写入 image_exif_index 表，每行为 (哈希值, 拍摄时间, GPS坐标)
+def exif_writer(conn, on_error=None):
+    return BulkWriter(conn, 'image_exif_index', ('id', 'capture_time', 'gps_info'), ('capture_time', 'gps_info'),
+                      on_error=on_error)
+
+# 将EXIF信息添加到批量写入器
+def add_exif_to_db(image_hash, exif_data, writer):
+    capture_time, gps_coordinates = summarize_exif(exif_data)
+    writer.add((to_key(image_hash), capture_time, gps_coordinates))
 
 # 从文件中获取 MoveImg.py 创建的文件夹路径
 def get_created_folder_path_from_file(file_path):
@@ -93,13 +120,19 @@ def main():
         logging.info("未找到创建的文件夹路径。")
         return
 
-    for subdir, dirs, files in os.walk(max_subfolder_path):
-        for file in files:
-            if file.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-                image_path = os.path.join(subdir, file)
-                image_hash = calculate_file_hash(image_path)
-                exif_data = get_exif_data(image_path)
-                add_exif_to_db(image_hash, exif_data, conn)
+    cursor = conn.cursor()
+    create_exif_table(cursor)
+    conn.commit()
+    cursor.close()
+
+    with exif_writer(conn) as writer:
+        for subdir, dirs, files in os.walk(max_subfolder_path):
+            for file in files:
+                if file.lower().endswith(exif_extensions):
+                    image_path = os.path.join(subdir, file)
+                    image_hash = calculate_file_hash(image_path)
+                    exif_data = get_exif_data(image_path)
+                    add_exif_to_db(image_hash, exif_data, writer)
 
     conn.close()
 
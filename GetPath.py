@@ -1,38 +1,51 @@
 import os
 import mysql.connector
 from mysql.connector import Error
-import hashlib
 import logging
 from tqdm import tqdm
 from config import db_config
+from hash_cache import file_hash
+from bulk_writer import BulkWriter
+from image_keys import to_key
 
 # 常见的图片格式，包括RAW格式
 image_extensions = ['.png', '.jpg', '.jpeg', '.bmp', '.gif', '.cr2', '.nef', '.dng', '.crw', '.raw']
 
-# 配置日志
-logging.basicConfig(
-    filename='image_processing.log',  # 日志文件名
-    level=logging.INFO,  # 记录INFO级别及以上的日志
-    format='%(asctime)s - %(levelname)s - %(message)s',  # 日志格式
-)
-
 # 递归遍历文件夹，获取所有图片路径
 def get_image_paths(directory):
     image_paths = []
     for root, dirs, files in os.walk(directory):
         for file in files:
-            if any(file.lower().endswith(ext) for ext in image_extensions):
+            if is_image_file(file):
                 image_paths.append(os.path.join(root, file))
     return image_paths
 
-# 计算文件的哈希值
+# 计算文件的哈希值（通过共享的哈希缓存）
 def compute_file_hash(file_path):
-    hash_sha256 = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        # 分块读取文件内容并更新哈希值
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    return file_hash(file_path)
+
+# 判断文件是否为需要建立索引的图片
+def is_image_file(file_name):
+    return any(file_name.lower().endswith(ext) for ext in image_extensions)
+
+# 创建 image_index 表（如果不存在），使用哈希值作为id
+def create_image_index_table(cursor):
+    cursor.execute(''' 
+        CREATE TABLE IF NOT EXISTS image_index (
+            id BINARY(32) NOT NULL,
+            path VARCHAR(255),
+            size_in_mb FLOAT,
+            PRIMARY KEY (id)
+        )
+    ''')
+
+# 批量写入 image_index 表，每行为 (哈希值, 路径, 大小MB)
+def image_index_writer(conn, on_error=None):
+    return BulkWriter(conn, 'image_index', ('id', 'path', 'size_in_mb'), ('path', 'size_in_mb'), on_error=on_error)
+
+# 批量登记 image_index 表，哈希值已存在时保留原有的行（用于入库前按哈希值占用）
+def image_claim_writer(conn, on_error=None):
+    return BulkWriter(conn, 'image_index', ('id', 'path', 'size_in_mb'), on_error=on_error)
 
 # 创建图片索引并记录文件大小（以MB为单位）
 def create_image_index(directory, db_config):
@@ -47,17 +60,12 @@ def create_image_index(directory, db_config):
         cursor = conn.cursor()
 
         # 创建表，使用哈希值作为id
-        cursor.execute(''' 
-            CREATE TABLE IF NOT EXISTS image_index (
-                id CHAR(64) NOT NULL,
-                path VARCHAR(255),
-                size_in_mb FLOAT,
-                PRIMARY KEY (id)
-            )
-        ''')
-
-        # 使用tqdm显示进度条
-        with tqdm(total=len(image_paths), desc="Processing images", unit="image") as pbar:
+        create_image_index_table(cursor)
+        conn.commit()
+
+        # 使用tqdm显示进度条，按批次写入数据库
+        with tqdm(total=len(image_paths), desc="Processing images", unit="image") as pbar, \
+                image_index_writer(conn) as writer:
             for path in image_paths:
                 # 获取文件大小，并转换为MB
                 size_in_bytes = os.path.getsize(path)
@@ -67,16 +75,11 @@ def create_image_index(directory, db_config):
                 file_hash = compute_file_hash(path)
 
                 # 将哈希值和大小插入数据库
-                cursor.execute(''' 
-                    INSERT INTO image_index (id, path, size_in_mb) VALUES (%s, %s, %s)
-                ''', (file_hash, path, size_in_mb))
+                writer.add((to_key(file_hash), path, size_in_mb))
                 total_processed += 1  # 增加成功处理的数量
                 logging.info(f"Processed and added to DB: {path}")
                 pbar.update(1)  # 更新进度条
 
-        # 提交事务
-        conn.commit()
-
     except Error as e:
         logging.error(f"Error while connecting to MySQL: {e}")
     finally:
@@ -96,14 +99,22 @@ def get_created_folder_path_from_file(file_path):
         logging.error("The file containing the created folder path does not exist.")
         return None
 
-# 指定你的images目录路径
-images_dir = 'images'
-created_folder_path_file = 'created_folder_path.txt'  # MoveImg.py 需要将路径保存在这个文件中
-new_folder_path = get_created_folder_path_from_file(created_folder_path_file)
-
-if new_folder_path:
-    logging.info(f"Using created folder: {new_folder_path}")
-    total_processed = create_image_index(new_folder_path, db_config)
-    logging.info(f"Total images processed: {total_processed}")
-else:
-    logging.warning("Failed to get the created folder path.")
+if __name__ == '__main__':
+    # 配置日志
+    logging.basicConfig(
+        filename='image_processing.log',  # 日志文件名
+        level=logging.INFO,  # 记录INFO级别及以上的日志
+        format='%(asctime)s - %(levelname)s - %(message)s',  # 日志格式
+    )
+
+    # 指定你的images目录路径
+    images_dir = 'images'
+    created_folder_path_file = 'created_folder_path.txt'  # MoveImg.py 需要将路径保存在这个文件中
+    new_folder_path = get_created_folder_path_from_file(created_folder_path_file)
+
+    if new_folder_path:
+        logging.info(f"Using created folder: {new_folder_path}")
+        total_processed = create_image_index(new_folder_path, db_config)
+        logging.info(f"Total images processed: {total_processed}")
+    else:
+        logging.warning("Failed to get the created folder path.")
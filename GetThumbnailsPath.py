@@ -3,7 +3,9 @@ import os
 import mysql.connector
 from mysql.connector import Error
 from config import db_config
-from CreateThumbnails import compressed_images, calculate_file_hash  # 确保从CreateThumbnails.py导入compressed_images
+from bulk_writer import BulkWriter
+from image_keys import to_key
+from CreateThumbnails import create_compressed_images, calculate_file_hash
 
 
 # 计算文件大小并转换为MB
@@ -13,6 +15,115 @@ def get_file_size_in_mb(file_path):
     return round(file_size_mb, 2)
 
 
+# 获取以 compressed 文件夹为基准的相对路径
+def get_relative_compressed_path(compressed_path):
+    relative_compressed_path = os.path.relpath(compressed_path, os.getcwd())
+
+    # 确保路径以 'compressed/' 开头
+    if not relative_compressed_path.startswith('compressed/'):
+        relative_compressed_path = os.path.join('compressed', relative_compressed_path)
+    return relative_compressed_path
+
+
+# 创建 image_compression_index 表和 trash 表（如果不存在）
+def create_compression_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_compression_index (
+            id BINARY(32) NOT NULL,
+            compressed_path VARCHAR(255),
+            compressed_hash BINARY(32),
+            size FLOAT,  -- 单位MB
+            PRIMARY KEY (id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS trash (
+            id BINARY(32) NOT NULL,
+            compressed_path VARCHAR(255),
+            type TINYINT DEFAULT 0,  -- 默认值为0
+            trashed_at DATETIME DEFAULT NULL,  -- 移入回收站的时间
+            PRIMARY KEY (id),
+            KEY idx_trash_type_trashed_at (type, trashed_at),
+            FOREIGN KEY (id) REFERENCES image_compression_index(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+# 创建 image_rendition 表（如果不存在），记录每张图片的多尺寸版本
+def create_rendition_table(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_rendition (
+            id BINARY(32) NOT NULL,
+            name VARCHAR(16) NOT NULL,
+            path VARCHAR(255) NOT NULL,
+            width INT NOT NULL,
+            height INT NOT NULL,
+            size FLOAT,  -- 单位MB
+            PRIMARY KEY (id, name)
+        )
+    ''')
+
+
+# 批量写入 image_rendition 表，每行为 (哈希值, 尺寸名称, 路径, 宽, 高, 大小MB)
+def rendition_writer(conn, on_error=None):
+    return BulkWriter(conn, 'image_rendition', ('id', 'name', 'path', 'width', 'height', 'size'),
+                      ('path', 'width', 'height', 'size'), on_error=on_error)
+
+
+# 查找覆盖指定尺寸的最小版本，均不足时返回最大的版本；返回以 'compressed/' 开头的路径
+def find_rendition(cursor, compressed_path, width, height):
+    cursor.execute('''
+        SELECT r.path, r.width, r.height
+        FROM image_rendition r
+        JOIN image_compression_index ic ON r.id = ic.id
+        WHERE ic.compressed_path = %s
+        ORDER BY GREATEST(r.width, r.height)
+    ''', (compressed_path,))
+    renditions = cursor.fetchall()
+    if not renditions:
+        return None
+    for path, rendition_width, rendition_height in renditions:
+        # 按等比缩放显示时，宽或高任一方向达到要求即可铺满
+        if rendition_width >= width or rendition_height >= height:
+            return path
+    return renditions[-1][0]
+
+
+# 批量写入 image_compression_index 表，每行为 (哈希值, 压缩图路径, 压缩图哈希值, 大小MB)
+def compression_index_writer(conn, on_error=None):
+    return BulkWriter(conn, 'image_compression_index', ('id', 'compressed_path', 'compressed_hash', 'size'),
+                      ('compressed_path', 'compressed_hash', 'size'), on_error=on_error)
+
+
+# 批量写入 trash 表，每行为 (哈希值, 压缩图路径, 类型)
+# trash 通过外键引用 image_compression_index，需在其之后 flush
+# 重复写入（例如任务重试）时保留已有的 type，不会恢复用户已删除的图片
+def trash_writer(conn, on_error=None):
+    return BulkWriter(conn, 'trash', ('id', 'compressed_path', 'type'), ('compressed_path',), on_error=on_error)
+
+
+# 批量写入压缩图记录：先写 image_compression_index，再写 trash
+def write_compressed_images(conn, rows, sources=None, on_error=None):
+    """
+    参数:
+        conn: MySQL 连接。
+        rows (list): 每个元素是 (原图哈希值, 压缩图相对路径, 压缩图哈希值, 大小MB) 的元组，哈希值为十六进制字符串。
+        sources (list): 与 rows 一一对应，写入失败时传给 on_error，默认为行号。
+        on_error (callable): 单行写入失败时调用 on_error(source, 异常)，为 None 时批次失败直接抛出异常。
+    """
+    sources = list(range(len(rows))) if sources is None else sources
+    with compression_index_writer(conn, on_error) as writer:
+        for (image_hash, relative_compressed_path, compressed_hash, size_mb), source in zip(rows, sources):
+            writer.add((to_key(image_hash), relative_compressed_path, to_key(compressed_hash), size_mb), source)
+    # image_compression_index 写入失败的图片不再写 trash（外键会拒绝）
+    failed = set(writer.failed)
+    with trash_writer(conn, on_error) as writer:
+        for (image_hash, relative_compressed_path, _, _), source in zip(rows, sources):
+            if source not in failed:
+                writer.add((to_key(image_hash), relative_compressed_path, 0), source)
+
+
 # 生成所有图片的压缩版本并将信息添加到数据库
 def generate_image_index(compressed_images):
     try:
@@ -20,62 +131,22 @@ def generate_image_index(compressed_images):
         conn = mysql.connector.connect(**db_config)
         cursor = conn.cursor()
 
-        # 创建 image_compression_index 表（如果不存在）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS image_compression_index (
-                id CHAR(64) NOT NULL,
-                compressed_path VARCHAR(255),
-                compressed_hash CHAR(64),
-                size FLOAT,  -- 单位MB
-                PRIMARY KEY (id)
-            )
-        ''')
-
-        # 创建 trash 表（如果不存在）
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS trash (
-                id CHAR(64) NOT NULL,
-                compressed_path VARCHAR(255),
-                type TINYINT DEFAULT 0,  -- 默认值为0
-                PRIMARY KEY (id),
-                FOREIGN KEY (id) REFERENCES image_compression_index(id) ON DELETE CASCADE
-            )
-        ''')
+        # 创建 image_compression_index 表和 trash 表（如果不存在）
+        create_compression_tables(cursor)
+        conn.commit()
 
         # 插入压缩图片的哈希值、路径、压缩图哈希值和文件大小
+        rows = []
         for image_hash, compressed_path in compressed_images:
             # 获取以 compressed 文件夹为基准的路径
-            relative_compressed_path = os.path.relpath(compressed_path, os.getcwd())
-
-            # 确保路径以 'compressed/' 开头
-            if not relative_compressed_path.startswith('compressed/'):
-                relative_compressed_path = os.path.join('compressed', relative_compressed_path)
+            relative_compressed_path = get_relative_compressed_path(compressed_path)
 
             # 计算压缩图的哈希值和大小
             compressed_hash = calculate_file_hash(compressed_path)
             size_mb = get_file_size_in_mb(compressed_path)
 
-            # 插入或更新 image_compression_index 表
-            cursor.execute('''
-                INSERT INTO image_compression_index (id, compressed_path, compressed_hash, size)
-                VALUES (%s, %s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                    compressed_path = VALUES(compressed_path),
-                    compressed_hash = VALUES(compressed_hash),
-                    size = VALUES(size)
-            ''', (image_hash, relative_compressed_path, compressed_hash, size_mb))
-
-            # 将数据插入到 trash 表
-            cursor.execute('''
-                INSERT INTO trash (id, compressed_path, type)
-                VALUES (%s, %s, %s)
-                ON DUPLICATE KEY UPDATE
-                    compressed_path = VALUES(compressed_path),
-                    type = VALUES(type)
-            ''', (image_hash, relative_compressed_path, 0))
-
-        # 提交事务
-        conn.commit()
+            rows.append((image_hash, relative_compressed_path, compressed_hash, size_mb))
+        write_compressed_images(conn, rows)
 
     except Error as e:
         logging.info("连接 MySQL 时出错:", e)
@@ -86,5 +157,7 @@ def generate_image_index(compressed_images):
             logging.info("完成图像处理和数据库更新。")
 
 
-# 调用函数生成索引
-generate_image_index(compressed_images)
\ No newline at end of file
+if __name__ == '__main__':
+    # 生成压缩图并调用函数生成索引
+    compressed_images = create_compressed_images('images')
+    generate_image_index(compressed_images)
\ No newline at end of file
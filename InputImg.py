@@ -1,16 +1,42 @@
+if __name__ == '__main__':
+    # 作为 Web 服务启动时使用 eventlet，SocketIO 订阅 Redis 消息队列需要先替换标准库的 socket
+    import eventlet
+    eventlet.monkey_patch()
+
 import logging
 
 from flask import Flask, jsonify, request, send_from_directory
 from flask_cors import CORS
 from flask_socketio import SocketIO
 import os
-from celery import Celery
-from run_scripts import run_scripts  # 脚本模块
-from get_original_image import get_original_image_path  # 查询原图路径模块
-from config import db_config, configure_logging  # 数据库配置模块
-import mysql.connector  # 用于连接 MySQL 数据库
+import re
+from celery import Celery, chord
+from celery.signals import worker_process_init, worker_process_shutdown, worker_ready
+from pipeline import prepare_batch, process_images, release_images, is_transient_error  # 入库流水线模块
+from get_original_image import get_original_image_path, get_originals_by_paths, get_image_details  # 查询原图路径模块
+from GetThumbnailsPath import find_rendition  # 查询多尺寸版本模块
+from MoveImg import find_existing_hashes  # 按哈希批量查重模块
+from image_keys import from_db  # 图片哈希值主键转换模块
+from upload_storage import save_upload, new_batch_id, get_staging_dir, check_upload_name, remove_expired_staging_dirs  # 上传文件暂存模块
+import upload_sessions  # 分块断点续传模块
+import rmTemp  # 删除暂存目录模块
+from ingest_progress import ProgressReporter, get_progress  # 入库进度模块
+from pagination import parse_page_args, keyset_condition, keyset_order, paged_query, build_page  # 列表分页模块
+from tag_suggest import TagSuggestIndex, publish_tag_deltas  # 标签自动补全模块
+from response_cache import cached_listing, bump_generation  # 列表响应缓存模块
+from trash_retention import purge_expired_images  # 回收站自动清理模块
+from bulk_ops import parse_bulk_items, set_trash_type, destroy_images, tag_images, purge_trash, remove_files  # 批量操作模块
+from schema_migrations import run_migrations  # 数据库迁移模块
+from tag_index import add_tags, normalize_tag, get_tags_for_images, text_search_query, tags_search_query  # 标签索引模块
+from config import configure_logging  # 日志配置模块
+import mysql.connector  # 用于捕获 MySQL 错误
+import db_pool  # MySQL 连接池模块
+import CreateThumbnails  # 压缩图进程池
+from db_pool import get_connection
 from config import CELERY_BROKER_URL, CELERY_RESULT_BACKEND
-import json
+from config import TRASH_PURGE_BATCH_SIZE, TRASH_RETENTION_DAYS, TRASH_PURGE_INTERVAL, WORKER_THUMBNAIL_WORKERS
+from config import UPLOAD_STAGING_TTL, UPLOAD_SWEEP_INTERVAL
+from config import INGEST_CHUNK_SIZE, INGEST_MAX_RETRIES, INGEST_RETRY_DELAY, SOCKETIO_MESSAGE_QUEUE, DB_WORKER_POOL_SIZE, TAG_SUGGEST_LIMIT, LISTING_MAX_PAGE_SIZE
 
 
 # 配置日志
@@ -34,8 +60,8 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(COMPRESSED_FOLDER, exist_ok=True)
 os.makedirs(ORIGINAL_FOLDER, exist_ok=True)  # 确保 images 目录存在
 
-# 初始化 SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*")  # 允许所有跨域连接
+# 初始化 SocketIO，Celery worker 通过 Redis 消息队列推送的事件由这里转发给浏览器
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE)  # 允许所有跨域连接
 
 # 配置 Celery
 app.config['CELERY_BROKER_URL'] = CELERY_BROKER_URL
@@ -50,16 +76,183 @@ celery = Celery(
 
 # 自动发现任务模块
 celery.conf.update(app.config)
+# 每个 worker 进程一次只预取一个任务，图片分块均匀分布到所有 worker
+celery.conf.worker_prefetch_multiplier = 1
+
+
+# worker 子进程同一时间只执行一个任务，使用较小的连接池
+@worker_process_init.connect
+def configure_worker_db_pool(**kwargs):
+    db_pool.configure(DB_WORKER_POOL_SIZE)
+
+
+# 每个 worker 子进程只创建一次压缩图进程池，各分块任务复用
+@worker_process_init.connect
+def configure_worker_thumbnail_pool(**kwargs):
+    CreateThumbnails.configure_pool(WORKER_THUMBNAIL_WORKERS)
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_thumbnail_pool(**kwargs):
+    CreateThumbnails.shutdown_pool()
+
+
+# worker 启动时执行数据库迁移，入库过程中不再建表和建索引
+@worker_ready.connect
+def migrate_schema_on_worker_ready(**kwargs):
+    run_migrations()
 celery.autodiscover_tasks(['InputImg'])
 
-# 异步任务
+# 异步任务：准备批次后将图片分块，分发给所有 worker 并行处理，全部完成后执行收尾任务
+# 各阶段的进度通过 update_state 和 SocketIO 的 ingest_progress 事件发布
+@celery.task(bind=True)
+def process_files(self, batch_id):
+    reporter = ProgressReporter(batch_id, task=self)
+    try:
+        ctx = prepare_batch(batch_id, reporter=reporter)  # 扫描、去重、移动文件并写入原图索引
+        items = [record.to_task() for record in ctx.images()]
+        chunks = [items[i:i + INGEST_CHUNK_SIZE] for i in range(0, len(items), INGEST_CHUNK_SIZE)]
+        # 所有分块共用 images 阶段的进度
+        reporter.stage_started("images", len(items), sum(item["size_in_bytes"] for item in items))
+        # 分块或收尾任务最终失败时，由 fail_batch 结束批次并记录错误状态
+        on_error = fail_batch.s(batch_id)
+        if chunks:
+            result = chord(process_image_chunk.s(batch_id, chunk) for chunk in chunks)(
+                finalize_files.s(batch_id).on_error(on_error))
+        else:
+            result = finalize_files.apply_async(([], batch_id), link_error=on_error)
+        logging.info(f"批次 {batch_id} 共 {len(items)} 张图片，分为 {len(chunks)} 个任务")
+        return {"status": "success", "message": "Files dispatched for processing", "batch_id": batch_id,
+                "images": len(items), "chunks": len(chunks), "finalize_task_id": result.id}
+    except Exception as e:
+        reporter.finished("error")
+        return {"status": "error", "message": str(e), "batch_id": batch_id}
+
+
+# 处理一组图片，返回 (处理成功的图片数, [(图片数据, 错误信息, 是否为临时错误), ...])
+# 整组执行出错时逐张重新处理，只有出错的图片记为失败
+def run_image_chunk(batch_id, items, reporter):
+    try:
+        ctx = process_images(batch_id, items, reporter=reporter)
+    except Exception as e:
+        if len(items) == 1:
+            return 0, [(items[0], str(e), is_transient_error(e))]
+        logging.info(f"批次 {batch_id} 分块处理出错，逐张重新处理: {e}")
+        processed, failed = 0, []
+        for item in items:
+            count, errors = run_image_chunk(batch_id, [item], reporter)
+            processed += count
+            failed.extend(errors)
+        return processed, failed
+    return len(ctx.images()), [(record.to_task(), record.error, record.transient)
+                               for record in ctx.records if record.error]
+
+
+# 处理一块图片；数据库写入均为 upsert，任务重复执行不会产生重复数据
+# 只有临时错误（数据库、磁盘读写）的图片单独重试，不重新处理同一块中已成功的图片；
+# 无法解码等确定性错误的图片和重试次数用完的图片立即放弃，原图移到隔离目录，不使整个批次失败
+@celery.task(bind=True, acks_late=True, max_retries=INGEST_MAX_RETRIES, default_retry_delay=INGEST_RETRY_DELAY)
+def process_image_chunk(self, batch_id, items, processed=0, abandoned=()):
+    count, failed = run_image_chunk(batch_id, items, ProgressReporter(batch_id, task=self, shared=True))
+    processed += count
+    can_retry = self.request.retries < self.max_retries
+    retry = [item for item, _, transient in failed if transient and can_retry]
+    given_up = [(item, error) for item, error, transient in failed if not (transient and can_retry)]
+    for item, error in given_up:
+        logging.info(f"图片处理失败，已放弃: {item['path']}: {error}")
+    release_images([item for item, _ in given_up])
+    abandoned = list(abandoned) + [item["path"] for item, _ in given_up]
+    if retry:
+        logging.info(f"批次 {batch_id} 有 {len(retry)} 张图片处理失败，稍后重试")
+        raise self.retry(args=[batch_id, retry], kwargs={"processed": processed, "abandoned": abandoned})
+    return {"processed": processed, "failed": abandoned}
+
+
+# 批次收尾：使列表缓存失效并汇总各分块的结果，不访问数据库
+@celery.task(bind=True)
+def finalize_files(self, results, batch_id):
+    reporter = ProgressReporter(batch_id, task=self)
+    bump_generation()
+    reporter.finished("done")
+    failed = [path for result in results for path in result["failed"]]
+    return {"status": "success", "message": "Files processed successfully", "batch_id": batch_id,
+            "processed": sum(result["processed"] for result in results), "failed": failed}
+
+
+# 分块或收尾任务最终失败时调用（link_error）：已入库的图片照常显示，进度标记为 error
+@celery.task
+def fail_batch(request, exc, traceback, batch_id):
+    logging.info(f"批次 {batch_id} 处理失败: {exc}")
+    bump_generation()
+    ProgressReporter(batch_id).finished("error")
+
+
+# 删除已从数据库彻底删除的图片文件（压缩图、原图和各尺寸版本）
 @celery.task
-def process_files():
+def remove_image_files(paths):
+    removed, removed_bytes = remove_files(paths)
+    logging.info(f"已删除 {removed} 个图片文件，共 {removed_bytes} 字节")
+    return {"removed": removed, "removed_bytes": removed_bytes}
+
+
+# 将文件删除交给 Celery；消息队列不可用时在当前进程中删除
+def schedule_file_removal(paths):
+    if not paths:
+        return
     try:
-        run_scripts()  # 调用脚本处理上传的文件
-        return {"status": "success", "message": "Files processed successfully"}
+        remove_image_files.delay(paths)
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        logging.info(f"提交删除文件任务失败，直接删除: {e}")
+        remove_files(paths)
+
+
+# 清空回收站：按批删除，每批一个事务，避免长时间持有行锁
+# 任务在 worker 中执行，删除的标签使用次数通过 Redis 发布给 Web 进程的自动补全索引
+@celery.task(bind=True)
+def empty_trash(self):
+    def on_batch(destroyed, freed_bytes, removed_tags):
+        bump_generation()
+        publish_tag_deltas({tag: -count for tag, count in removed_tags.items()})
+        self.update_state(state='PROGRESS', meta={"destroyed": destroyed, "freed_bytes": freed_bytes})
+
+    destroyed = purge_trash(TRASH_PURGE_BATCH_SIZE, on_batch=on_batch)
+    return {"status": "success", "destroyed": destroyed}
+
+
+# 定时任务：彻底删除移入回收站超过 TRASH_RETENTION_DAYS 天的图片，按行数和字节数限速
+@celery.task
+def purge_expired_trash():
+    if TRASH_RETENTION_DAYS <= 0:
+        return {"status": "disabled", "destroyed": 0}
+
+    def on_batch(destroyed, freed_bytes, removed_tags):
+        bump_generation()
+        publish_tag_deltas({tag: -count for tag, count in removed_tags.items()})
+
+    destroyed = purge_expired_images(TRASH_RETENTION_DAYS, on_batch=on_batch)
+    return {"status": "success", "destroyed": destroyed}
+
+
+# 定时任务：删除超过 UPLOAD_STAGING_TTL 秒没有写入的暂存目录（放弃的分块上传会话、未能提交入库任务的批次）
+@celery.task
+def expire_upload_staging():
+    removed = remove_expired_staging_dirs(UPLOAD_STAGING_TTL)
+    return {"status": "success", "removed": removed}
+
+
+# 由 celery beat 定时触发（docker-compose 的 beat 服务，或单独运行 celery -A InputImg.celery beat）；未执行的旧任务在下次触发前过期
+celery.conf.beat_schedule = {
+    'purge-expired-trash': {
+        'task': purge_expired_trash.name,
+        'schedule': TRASH_PURGE_INTERVAL,
+        'options': {'expires': TRASH_PURGE_INTERVAL},
+    },
+    'expire-upload-staging': {
+        'task': expire_upload_staging.name,
+        'schedule': UPLOAD_SWEEP_INTERVAL,
+        'options': {'expires': UPLOAD_SWEEP_INTERVAL},
+    },
+}
 
 
 # 处理文件上传
@@ -73,54 +266,42 @@ def handle_file_upload(file_key):
         return jsonify({"error": "No files selected"}), 400
 
     saved_files = []
-    # 允许的图片文件扩展名集合
-    valid_extensions = {
-        'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'webp', 'ico', 'heic', 'heif', 'jfif', 'pcx', 'ppm', 'pbm',
-        'psd'
-    }
+    # 每次上传使用独立的批次 ID 和暂存目录
+    batch_id = new_batch_id()
+    staging_dir = get_staging_dir(batch_id)
+    task = None
     try:
         for file in files:
             if file:
                 # 获取原始文件名并确保安全
                 filename = os.path.basename(file.filename)
-                # 检查是否为隐藏文件，隐藏文件名以点开头
-                if filename.startswith('.'):
-                    logging.info(f"检查到隐藏文件“{filename}”，已跳过")
+                # 跳过隐藏文件和非图片文件
+                skip_reason = check_upload_name(filename)
+                if skip_reason:
+                    logging.info(skip_reason)
                     continue
 
-                # 获取文件扩展名
-                ext = filename.split('.')[-1].lower()
-                if ext not in valid_extensions:
-                    logging.info(f"检查到非图片文件“{filename}”，已跳过")
-                    continue
-
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-                # 检查文件是否已存在，如果存在则在文件名末尾添加序号
-                base_name, ext = os.path.splitext(filename)
-                counter = 1
-                while os.path.exists(file_path):
-                    new_filename = f"{base_name}_{counter}{ext}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                    counter += 1
-
-                # 创建保存目录并保存文件
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
-                file.save(file_path)
-                saved_files.append(file_path)
+                # 分块写入暂存目录并同时计算哈希，文件以内容哈希命名
+                file_path, _, is_new = save_upload(file.stream, staging_dir, filename)
+                if is_new:
+                    saved_files.append(file_path)
 
                 # 打印已上传文件信息
                 #logging.info(f"已上传文件: {file_path}")
 
-        # 调用异步任务处理文件
-        task = process_files.apply_async()
+        # 调用异步任务处理该批次的文件
+        task = process_files.apply_async(args=[batch_id])
 
         # 文件上传完成后通知前端
-        socketio.emit('task_started', {'task_id': task.id, 'message': 'Files uploaded, processing started'})
+        socketio.emit('task_started', {'task_id': task.id, 'batch_id': batch_id,
+                                       'message': 'Files uploaded, processing started'})
     except Exception as e:
+        # 入库任务未提交时删除本批次已写入的文件；已提交的批次由任务自己删除暂存目录
+        if task is None:
+            rmTemp.delete_temp_folder(staging_dir)
         return jsonify({"error": f"An error occurred: {str(e)}"}), 500
 
-    return jsonify({"message": "Files uploaded successfully", "files": saved_files}), 200
+    return jsonify({"message": "Files uploaded successfully", "batch_id": batch_id, "files": saved_files}), 200
 
 @app.route('/')
 def index():
@@ -134,6 +315,11 @@ def InputImg():
     # 使用 send_from_directory 来发送 index.html 文件
     return send_from_directory('frontend', 'InputImg.html')
 
+@app.route('/hash_worker.js')
+def hash_worker():
+    # 上传页面在 Web Worker 中计算文件哈希的脚本
+    return send_from_directory('frontend', 'hash_worker.js')
+
 # 上传文件夹接口
 @app.route('/upload_folder', methods=['POST'])
 def upload_folder():
@@ -146,6 +332,148 @@ def upload_images():
     return handle_file_upload('images')
 
 
+# 创建分块上传会话
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    files = data.get('files')
+    if not isinstance(files, list) or not files:
+        return jsonify({"error": "files is required"}), 400
+
+    try:
+        upload_id, entries = upload_sessions.create_session(files)
+    except (TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid file list"}), 400
+    return jsonify({"upload_id": upload_id, "files": entries}), 201
+
+
+# 上传前查重：接收文件内容哈希列表，返回图库中尚不存在的哈希
+@app.route('/api/uploads/preflight', methods=['POST'])
+def preflight_upload():
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list) or not all(isinstance(h, str) and re.fullmatch(r'[0-9a-f]{64}', h) for h in hashes):
+        return jsonify({"error": "hashes must be a list of SHA-256 hex digests"}), 400
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        existing = find_existing_hashes(cursor, hashes)
+    except mysql.connector.Error as err:
+        logging.info(f"MySQL error: {err}")
+        return jsonify({"error": "Database error occurred"}), 500
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
+
+    missing = [h for h in dict.fromkeys(hashes) if h not in existing]
+    logging.info(f"上传前查重：共 {len(hashes)} 个文件，{len(missing)} 个需要上传")
+    return jsonify({"missing": missing}), 200
+
+
+# 读取上传会话，会话不存在时返回 None
+def get_upload_session(upload_id):
+    try:
+        return upload_sessions.load_session(upload_id)
+    except ValueError:
+        return None
+
+
+# 查询会话中所有文件已接收的字节数
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def get_upload_status(upload_id):
+    session = get_upload_session(upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+    files = [upload_sessions.get_file_status(session, entry) for entry in session["files"].values()]
+    return jsonify({"upload_id": upload_id, "files": files}), 200
+
+
+# 查询单个文件已接收的字节数
+@app.route('/api/uploads/<upload_id>/files/<file_id>', methods=['GET'])
+def get_upload_file_status(upload_id, file_id):
+    session = get_upload_session(upload_id)
+    if not session or file_id not in session["files"]:
+        return jsonify({"error": "Upload file not found"}), 404
+    return jsonify(upload_sessions.get_file_status(session, session["files"][file_id])), 200
+
+
+# 上传文件的一段数据，请求头 Content-Range: bytes <start>-<end>/<size>
+@app.route('/api/uploads/<upload_id>/files/<file_id>', methods=['PUT'])
+def put_upload_chunk(upload_id, file_id):
+    session = get_upload_session(upload_id)
+    if not session or file_id not in session["files"]:
+        return jsonify({"error": "Upload file not found"}), 404
+
+    content_range = request.headers.get('Content-Range', '')
+    try:
+        start = int(content_range.split(' ')[1].split('-')[0]) if content_range else 0
+    except (IndexError, ValueError):
+        return jsonify({"error": "Invalid Content-Range"}), 400
+
+    entry = session["files"][file_id]
+    try:
+        status = upload_sessions.write_chunk(session, entry, start, request.stream)
+    except upload_sessions.UploadConflict as e:
+        return jsonify({"error": "Offset mismatch", "offset": e.offset}), 409
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(status), 200
+
+
+# 所有文件上传完成后开始处理该批次
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+def finalize_upload(upload_id):
+    session = get_upload_session(upload_id)
+    if not session:
+        return jsonify({"error": "Upload not found"}), 404
+
+    incomplete = upload_sessions.get_incomplete_files(session)
+    if incomplete:
+        return jsonify({"error": "Upload incomplete", "files": incomplete}), 409
+    if not upload_sessions.close_session(session):
+        return jsonify({"error": "Upload already finalized"}), 409
+
+    # 调用异步任务处理该批次的文件
+    task = process_files.apply_async(args=[upload_id])
+    socketio.emit('task_started', {'task_id': task.id, 'batch_id': upload_id,
+                                   'message': 'Files uploaded, processing started'})
+    return jsonify({"message": "Upload finalized", "task_id": task.id, "batch_id": upload_id}), 200
+
+
+# 标签自动补全索引，启动时加载，添加标签和彻底删除图片时增量更新；worker 中的变化通过 Redis 订阅接收
+tag_suggestions = TagSuggestIndex()
+
+
+# 标签自动补全：返回以 prefix 开头的标签及使用次数，按使用次数排序
+@app.route('/api/tags/suggest', methods=['GET'])
+def suggest_tags():
+    prefix = request.args.get('prefix', '').strip()
+    limit = min(max(request.args.get('limit', TAG_SUGGEST_LIMIT, type=int) or TAG_SUGGEST_LIMIT, 1), 100)
+    if not prefix:
+        return jsonify({"tags": []}), 200
+    return jsonify({"tags": tag_suggestions.suggest(prefix, limit)}), 200
+
+
+# 查询数据库连接池的取连接等待统计
+@app.route('/api/db_pool_stats', methods=['GET'])
+def get_db_pool_stats():
+    return jsonify(db_pool.get_stats()), 200
+
+
+# 查询批次的入库进度
+@app.route('/api/batches/<batch_id>/progress', methods=['GET'])
+def get_batch_progress(batch_id):
+    progress = get_progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Progress not found"}), 404
+    return jsonify(progress), 200
+
+
 # 获取任务状态
 @app.route('/api/task_status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
@@ -153,7 +481,11 @@ def get_task_status(task_id):
     if task.state == 'PENDING':
         return jsonify({'state': task.state, 'status': 'Task is pending'}), 200
     elif task.state != 'FAILURE':
-        return jsonify({'state': task.state, 'status': task.info}), 200
+        response = {'state': task.state, 'status': task.info}
+        # 图片分发给其他任务处理后，从汇总的进度中读取整个批次的进度
+        if isinstance(task.info, dict) and task.info.get('batch_id'):
+            response['progress'] = get_progress(task.info['batch_id'])
+        return jsonify(response), 200
     else:
         return jsonify({'state': task.state, 'status': str(task.info)}), 500
 
@@ -180,6 +512,68 @@ def get_original_image():
         return jsonify({"error": "Original image not found"}), 404
 
 
+# 批量查询原图路径，请求体为 {"compressed_paths": [...]}
+# 返回 {"images": {压缩图路径: {"id", "original_path", "original_url"}}}，查不到的路径不包含在内
+@app.route('/api/original_images', methods=['POST'])
+def get_original_images():
+    data = request.get_json(silent=True) or {}
+    compressed_paths = data.get('compressed_paths')
+    if not isinstance(compressed_paths, list) or not all(isinstance(path, str) for path in compressed_paths):
+        return jsonify({"error": "compressed_paths must be a list of strings"}), 400
+    if len(compressed_paths) > LISTING_MAX_PAGE_SIZE:
+        return jsonify({"error": f"At most {LISTING_MAX_PAGE_SIZE} paths per request"}), 400
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        return jsonify({"images": get_originals_by_paths(cursor, compressed_paths)}), 200
+    except mysql.connector.Error as err:
+        logging.info(f"MySQL error: {err}")
+        return jsonify({"error": "Database error occurred"}), 500
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
+
+
+# 按显示尺寸提供覆盖该尺寸的最小版本
+@app.route('/api/rendition', methods=['GET'])
+def get_rendition():
+    compressed_path = request.args.get('compressed_path')
+    if not compressed_path:
+        return jsonify({"error": "compressed_path parameter is required"}), 400
+
+    width = request.args.get('width', 0, type=int)
+    height = request.args.get('height', 0, type=int)
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        rendition_path = find_rendition(cursor, compressed_path, width, height)
+    except mysql.connector.Error as err:
+        logging.info(f"MySQL error: {err}")
+        return jsonify({"error": "Database error occurred"}), 500
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
+
+    if rendition_path:
+        return send_from_directory(app.config['COMPRESSED_FOLDER'], os.path.relpath(rendition_path, COMPRESSED_FOLDER))
+
+    # 旧数据没有多尺寸版本，退回到原图
+    original_image_path = get_original_image_path(compressed_path)
+    if original_image_path:
+        return send_from_directory(ORIGINAL_FOLDER, os.path.relpath(original_image_path, 'images'))
+    return jsonify({"error": "Image not found"}), 404
+
+
 # 提供原图文件
 @app.route('/images/<path:filename>', methods=['GET'])
 def serve_original_image(filename):
@@ -204,15 +598,17 @@ def delete_image():
     if not compressed_path:
         return jsonify({"error": "Image path is required"}), 400
 
+    connection = None
+    cursor = None
     try:
         # 连接数据库
-        connection = mysql.connector.connect(**db_config)
+        connection = get_connection()
         cursor = connection.cursor()
 
         # 更新数据库中的 type 字段为 1
         update_query = """
         UPDATE trash
-        SET type = 1
+        SET type = 1, trashed_at = NOW()
         WHERE compressed_path = %s
         """
         cursor.execute(update_query, (compressed_path,))
@@ -220,6 +616,7 @@ def delete_image():
 
         # 检查是否成功更新
         if cursor.rowcount > 0:
+            bump_generation()
             return jsonify({"success": True, "message": "Image marked as deleted"}), 200
         else:
             return jsonify({"success": False, "message": "Image not found in database"}), 404
@@ -227,9 +624,10 @@ def delete_image():
         logging.info(f"MySQL error: {err}")
         return jsonify({"error": "Database error occurred"}), 500
     finally:
-        if connection.is_connected():
+        if cursor is not None:
             cursor.close()
-            connection.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
 
 # 恢复图片接口
 @app.route('/api/recover_image', methods=['POST'])
@@ -243,15 +641,17 @@ def recover_image():
     if not compressed_path:
         return jsonify({"error": "Image path is required"}), 400
 
+    connection = None
+    cursor = None
     try:
         # 连接数据库
-        connection = mysql.connector.connect(**db_config)
+        connection = get_connection()
         cursor = connection.cursor()
 
         # 更新数据库中的 type 字段为 0
         update_query = """
         UPDATE trash
-        SET type = 0
+        SET type = 0, trashed_at = NULL
         WHERE compressed_path = %s
         """
         cursor.execute(update_query, (compressed_path,))
@@ -259,6 +659,7 @@ def recover_image():
 
         # 检查是否成功更新
         if cursor.rowcount > 0:
+            bump_generation()
             return jsonify({"success": True, "message": "Image marked as deleted"}), 200
         else:
             return jsonify({"success": False, "message": "Image not found in database"}), 404
@@ -266,77 +667,87 @@ def recover_image():
         logging.info(f"MySQL error: {err}")
         return jsonify({"error": "Database error occurred"}), 500
     finally:
-        if connection.is_connected():
+        if cursor is not None:
             cursor.close()
-            connection.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
+
+# 执行分页查询，并一次查询本页所有图片的标签、原图和多尺寸版本
+def fetch_page(cursor, query, params, limit):
+    cursor.execute(query, params)
+    # 主键为 BINARY(32)，统一为 bytes 后再作为字典键
+    rows = [(compressed_path, from_db(image_id)) for compressed_path, image_id in cursor.fetchall()]
+    image_ids = [image_id for _, image_id in rows[:limit]]
+    return build_page(rows, limit, get_tags_for_images(cursor, image_ids), get_image_details(cursor, image_ids))
+
+
+# 分页查询 trash 表中指定类型（0 为主页，1 为回收站）的图片及标签
+def query_trash_page(image_type, after, limit):
+    connection = get_connection()
+    try:
+        cursor = connection.cursor()
+        condition, params = keyset_condition('trash.compressed_path', 'trash.id', after)
+        page = fetch_page(cursor, """
+            SELECT trash.compressed_path, trash.id FROM trash
+            JOIN image_compression_index ic ON trash.id = ic.id
+            WHERE trash.type = %s""" + condition + keyset_order('trash.compressed_path', 'trash.id') + """
+            LIMIT %s
+        """, [image_type] + params + [limit + 1], limit)
+        cursor.close()
+    finally:
+        connection.close()  # 归还连接池
+    return page
+
 
-# 查询主页图片及标签
+# 查询主页图片及标签，按 cursor 分页，返回 {"images": [...], "next_cursor": ...}
 @app.route('/api/home_images', methods=['GET'])
+@cached_listing
 def get_home_images():
     try:
-        # 使用从config.py中导入的配置
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT ic.compressed_path, it.tags FROM trash
-            JOIN image_compression_index ic ON trash.compressed_path = ic.compressed_path
-            LEFT JOIN imageTag it ON ic.compressed_path = it.compressed_path
-            WHERE trash.type = 0
-        """)
-        home_images = cursor.fetchall()
-
-        # 提取图片路径和标签，并返回
-        image_data = []
-        for image, tags in home_images:
-            tags = json.loads(tags) if tags else []
-            image_data.append({
-                "compressed_path": image,
-                "tags": tags
-            })
-        return jsonify(image_data)
+        after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return jsonify(query_trash_page(0, after, limit))
 
     except Exception as e:
         logging.info(f"查询主页图片失败: {e}")
         return jsonify({"error": "加载主页图片失败"}), 500
 
-    finally:
-        # 确保资源正确释放
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-
-# 查询搜索图片及标签
+# 查询搜索图片及标签，按 cursor 分页
+# query 为关键词（标签前缀或文件名）；tag 可重复出现，按标签精确查询，mode 为 and（默认）或 or
 @app.route('/api/search_images', methods=['GET'])
+@cached_listing
 def get_search_images():
+    # 从查询参数中获取搜索关键词
+    search_query = request.args.get('query', '').strip()  # 默认为空字符串，如果没有提供查询参数
+    tags = list({tag.casefold(): tag for tag in (normalize_tag(t) for t in request.args.getlist('tag')) if tag}.values())
+    mode = request.args.get('mode', 'and')
+    if mode not in ('and', 'or'):
+        return jsonify({"error": "mode must be 'and' or 'or'"}), 400
     try:
-        # 从查询参数中获取搜索关键词
-        search_query = request.args.get('query', '')  # 默认为空字符串，如果没有提供查询参数
+        after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if tags:
+        subquery, params = tags_search_query(tags, mode == 'and')
+    elif search_query:
+        subquery, params = text_search_query(search_query)
+    else:
+        subquery, params = "SELECT compressed_path, id FROM image_compression_index", []
 
+    connection = None
+    cursor = None
+    try:
         # 使用从config.py中导入的配置
-        connection = mysql.connector.connect(**db_config)
+        connection = get_connection()
         cursor = connection.cursor()
 
-        # 构建查询语句，同时考虑compressed_path和tags字段
-        # 确保这里的表名和字段名与数据库中的实际名称一致
-        query = """
-            SELECT ic.compressed_path, it.tags 
-            FROM image_compression_index ic
-            LEFT JOIN imageTag it ON ic.compressed_path = it.compressed_path
-            WHERE ic.compressed_path LIKE %s OR it.tags LIKE %s
-        """
-        cursor.execute(query, ('%' + search_query + '%', '%' + search_query + '%'))
-        search_images = cursor.fetchall()
-
-        # 提取图片路径和标签，并返回
-        image_data = []
-        for compressed_path, tags in search_images:
-            tags = json.loads(tags) if tags else []
-            image_data.append({
-                "compressed_path": compressed_path,
-                "tags": tags
-            })
-        return jsonify(image_data)
+        # 标签和文件名都通过索引匹配，再按分页排序键取一页
+        query, params = paged_query(subquery, params, after, limit)
+        return jsonify(fetch_page(cursor, query, params, limit))
 
     except Exception as e:
         logging.info(f"查询搜索图片失败: {e}")
@@ -344,49 +755,29 @@ def get_search_images():
 
     finally:
         # 确保资源正确释放
-        if cursor:
+        if cursor is not None:
             cursor.close()
-        if connection:
-            connection.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
 
-# 查询回收站图片及标签
+# 查询回收站图片及标签，按 cursor 分页
 @app.route('/api/trash_images', methods=['GET'])
+@cached_listing
 def get_trash_images():
     try:
-        # 使用从config.py中导入的配置
-        connection = mysql.connector.connect(**db_config)
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT ic.compressed_path, it.tags FROM trash
-            JOIN image_compression_index ic ON trash.compressed_path = ic.compressed_path
-            LEFT JOIN imageTag it ON ic.compressed_path = it.compressed_path
-            WHERE trash.type = 1
-        """)
-        trash_images = cursor.fetchall()
-
-        # 提取图片路径和标签，并返回
-        image_data = []
-        for compressed_path, tags in trash_images:
-            tags = json.loads(tags) if tags else []
-            image_data.append({
-                "compressed_path": compressed_path,
-                "tags": tags
-            })
-        return jsonify(image_data)
+        after, limit = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        return jsonify(query_trash_page(1, after, limit))
 
     except Exception as e:
         logging.info(f"查询回收站图片失败: {e}")
         return jsonify({"error": "加载回收站图片失败"}), 500
 
-    finally:
-        # 确保资源正确释放
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
-
 
-# 彻底删除图片
+# 彻底删除图片：各表的记录在一个事务中删除，提交后由 Celery 任务删除文件
 @app.route('/api/destroy_image', methods=['POST'])
 def destroy_image():
     data = request.get_json()
@@ -398,74 +789,126 @@ def destroy_image():
     # 打印图片路径，方便调试
     logging.info(f"彻底删除的压缩图像路径: {image_path}")
 
+    connection = None
+    cursor = None
     try:
         # 连接数据库
-        connection = mysql.connector.connect(**db_config)
+        connection = get_connection()
         cursor = connection.cursor()
 
-        # 1. 获取图片在trash表中的id，根据compressed_path查找
-        cursor.execute("SELECT id FROM trash WHERE compressed_path = %s", (image_path,))
-        result = cursor.fetchone()
-
-        if not result:
-            return jsonify({"error": "Image not found in trash"}), 404
-
-        id = result[0]  # 获取对应的id
-
-        # 2. 获取图片在image_compression_index和image_index表中的路径
-        cursor.execute("SELECT compressed_path FROM image_compression_index WHERE id = %s", (id,))
-        compressed_path_result = cursor.fetchone()
-
-        cursor.execute("SELECT path FROM image_index WHERE id = %s", (id,))
-        original_path_result = cursor.fetchone()
-
-        if not compressed_path_result or not original_path_result:
-            return jsonify({"error": "Paths not found in related tables"}), 404
+        results, file_paths, removed_tags = destroy_images(cursor, [("path", image_path)])
+        if not results[0]["success"]:
+            connection.rollback()
+            return jsonify({"error": results[0]["message"]}), 404
+        connection.commit()
 
-        compressed_path = compressed_path_result[0]
-        original_path = original_path_result[0]
+    except mysql.connector.Error as err:
+        if connection is not None:
+            connection.rollback()
+        logging.info(f"MySQL error: {err}")
+        return jsonify({"error": "Database error occurred"}), 500
+    finally:
+        if cursor is not None:
+            cursor.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
 
-        # 3. 删除与该图片相关的所有记录
-        delete_queries = {
-            "trash": "DELETE FROM trash WHERE id = %s",
-            "image_index": "DELETE FROM image_index WHERE id = %s",
-            "image_compression_index": "DELETE FROM image_compression_index WHERE id = %s",
-            "imageTag": "DELETE FROM imageTag WHERE compressed_path = %s",  # 添加删除imageTag表记录的查询
-            "image_exif_index": "DELETE FROM image_exif_index WHERE id = %s"
-        }
+    for tag, count in removed_tags.items():
+        tag_suggestions.add(tag, -count)
+    bump_generation()
+    schedule_file_removal(file_paths)
+    return jsonify({"success": True, "message": "Image and all related records have been permanently deleted"}), 200
 
-        # 删除记录
-        for table, query in delete_queries.items():
-            logging.info(f"从表 {table} 删除id为 {id} 的文件 {compressed_path}")  # 调试删除表的操作
-            if table == "imageTag":
-                cursor.execute(query, (compressed_path,))  # 对于imageTag表，使用compressed_path
-            else:
-                cursor.execute(query, (id,))
-            connection.commit()
 
-        # 4. 删除图片文件
-        # 直接使用数据库返回的相对路径
-        compressed_file_path = compressed_path
-        original_file_path = original_path
+# 清空回收站：由 Celery 任务按批删除，返回任务 id，可通过 /api/task_status 查询进度
+@app.route('/api/trash/empty', methods=['POST'])
+def empty_trash_endpoint():
+    task = empty_trash.delay()
+    return jsonify({"task_id": task.id}), 202
 
-        # 删除压缩图片和原始图片
-        if os.path.exists(compressed_file_path):
-            os.remove(compressed_file_path)  # 删除压缩图片文件
-        if os.path.exists(original_file_path):
-            os.remove(original_file_path)  # 删除原始图片文件
 
-        return jsonify({"success": True, "message": "Image and all related records have been permanently deleted"}), 200
+# 在一个事务中执行批量操作
+# operation(cursor, items) 返回 (每项结果, 是否有改动, 提交后执行的函数或 None)
+def run_bulk(operation):
+    try:
+        items = parse_bulk_items(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    connection = None
+    cursor = None
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        results, changed, on_commit = operation(cursor, items)
+        connection.commit()
     except mysql.connector.Error as err:
+        if connection is not None:
+            connection.rollback()
         logging.info(f"MySQL error: {err}")
         return jsonify({"error": "Database error occurred"}), 500
-    except Exception as e:
-        logging.info(f"Error: {e}")
-        return jsonify({"error": "An error occurred while deleting the image"}), 500
     finally:
-        if connection.is_connected():
+        if cursor is not None:
             cursor.close()
-            connection.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
+
+    if changed:
+        bump_generation()
+    if on_commit is not None:
+        on_commit()
+    succeeded = sum(1 for result in results if result["success"])
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}), 200
+
+
+# 批量操作接口：请求体为 {"ids": [...], "paths": [...]}，按哈希值或压缩图路径指定图片，
+# 所有图片在一个事务中处理，返回 {"results": [每项结果], "succeeded": 成功数, "failed": 失败数}
+@app.route('/api/bulk/delete', methods=['POST'])
+def bulk_delete():
+    def operation(cursor, items):
+        results, changed = set_trash_type(cursor, items, 1)
+        return results, changed, None
+    return run_bulk(operation)
+
+
+@app.route('/api/bulk/recover', methods=['POST'])
+def bulk_recover():
+    def operation(cursor, items):
+        results, changed = set_trash_type(cursor, items, 0)
+        return results, changed, None
+    return run_bulk(operation)
+
+
+# 只删除回收站中的图片，事务提交后再删除文件
+@app.route('/api/bulk/destroy', methods=['POST'])
+def bulk_destroy():
+    def operation(cursor, items):
+        results, file_paths, removed_tags = destroy_images(cursor, items)
+
+        def on_commit():
+            for tag, count in removed_tags.items():
+                tag_suggestions.add(tag, -count)
+            schedule_file_removal(file_paths)
+        return results, bool(file_paths), on_commit
+    return run_bulk(operation)
+
+
+# 请求体另需 "tags": [标签, ...]
+@app.route('/api/bulk/add_tag', methods=['POST'])
+def bulk_add_tag():
+    tags = (request.get_json(silent=True) or {}).get('tags')
+    if not isinstance(tags, list) or not any(isinstance(tag, str) and normalize_tag(tag) for tag in tags):
+        return jsonify({"error": "tags must be a non-empty list of tags"}), 400
+
+    def operation(cursor, items):
+        results, added = tag_images(cursor, items, [tag for tag in tags if isinstance(tag, str)])
+
+        def on_commit():
+            for tag, count in added.items():
+                tag_suggestions.add(tag, count)
+        return results, bool(added), on_commit
+    return run_bulk(operation)
+
 
 # 添加标签接口
 @app.route('/api/add_tag', methods=['POST'])
@@ -477,53 +920,53 @@ def add_tag():
     # 打印信息，方便调试
     logging.info(f"收到图像路径： {compressed_path}, Tag received: {tag}")
 
+    tag = normalize_tag(tag) if tag else None
     if not compressed_path or not tag:
         return jsonify({"error": "Image path and tag are required"}), 400
 
+    connection = None
+    cursor = None
     try:
         # 连接数据库
-        connection = mysql.connector.connect(**db_config)
+        connection = get_connection()
         cursor = connection.cursor()
 
         # 检查图片是否存在于数据库中
-        check_query = "SELECT * FROM imageTag WHERE compressed_path = %s"
-        cursor.execute(check_query, (compressed_path,))
+        cursor.execute("SELECT id FROM image_compression_index WHERE compressed_path = %s", (compressed_path,))
         image = cursor.fetchone()
 
         if not image:
             return jsonify({"success": False, "message": "Image not found in database"}), 404
 
-        # 获取现有的标签JSON数组
-        existing_tags = image[2] if image[2] else '[]'  # 如果tags字段为空，则默认为空数组
-        tags_array = json.loads(existing_tags)
-
-        # 添加新的标签到数组中
-        tags_array.append(tag)
-
-        # 更新数据库中的标签
-        update_query = """
-        UPDATE imageTag
-        SET tags = %s
-        WHERE compressed_path = %s
-        """
-        cursor.execute(update_query, (json.dumps(tags_array), compressed_path))
+        # 写入标签字典和图片-标签关联表，重复添加同一标签不会产生重复记录
+        added = add_tags(cursor, image[0], [tag])
         connection.commit()
-
-        # 检查是否成功更新
-        if cursor.rowcount > 0:
-            return jsonify({"success": True, "message": "Tag added successfully"}), 200
-        else:
-            return jsonify({"success": False, "message": "Failed to add tag"}), 500
+        if added:
+            tag_suggestions.add(tag)
+            bump_generation()
+        return jsonify({"success": True, "message": "Tag added successfully"}), 200
     except mysql.connector.Error as err:
         logging.info(f"MySQL error: {err}")
         return jsonify({"error": "Database error occurred"}), 500
     finally:
-        if connection.is_connected():
+        if cursor is not None:
             cursor.close()
-            connection.close()
+        if connection is not None:
+            connection.close()  # 归还连接池
 
 
 
 if __name__ == '__main__':
+    # 执行数据库迁移（建表、建索引、迁移旧的 JSON 标签），再加载标签自动补全索引
+    run_migrations()
+    schema_connection = get_connection()
+    try:
+        schema_cursor = schema_connection.cursor()
+        tag_suggestions.load(schema_cursor)
+        schema_cursor.close()
+    finally:
+        schema_connection.close()
+    socketio.start_background_task(tag_suggestions.listen, get_connection)
+
     # 运行 Flask 和 SocketIO 服务器
     socketio.run(app, debug=True, host='0.0.0.0', port=5001, allow_unsafe_werkzeug=True)
\ No newline at end of file
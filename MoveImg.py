@@ -1,25 +1,51 @@
 import logging
 import os
 import shutil
-import hashlib
 from datetime import datetime
 import mysql.connector
 from mysql.connector import Error
 from config import db_config
+from hash_cache import file_hash
+from upload_storage import is_staged_file
+from image_keys import to_key, to_hex
 
-# 计算文件的哈希值
+# 计算文件的哈希值（通过共享的哈希缓存）
 def compute_file_hash(file_path):
-    hash_sha256 = hashlib.sha256()
-    with open(file_path, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    return file_hash(file_path)
+
+# 每次 IN 查询包含的哈希值数量
+DEDUP_CHUNK_SIZE = 1000
 
 # 检查文件的哈希值是否已经存在于数据库中
 def is_hash_in_db(cursor, image_hash):
-    cursor.execute('''SELECT COUNT(*) FROM image_index WHERE id = %s''', (image_hash,))
-    result = cursor.fetchone()
-    return result[0] > 0
+    return image_hash in find_existing_hashes(cursor, [image_hash])
+
+# 批量查询已存在于数据库中的哈希值，按块使用 IN 查询，返回十六进制哈希值的集合
+def find_existing_hashes(cursor, hashes, chunk_size=DEDUP_CHUNK_SIZE):
+    return set(find_indexed_paths(cursor, hashes, chunk_size))
+
+# 批量查询哈希值在 image_index 中记录的原图路径，返回 {十六进制哈希值: 路径}
+def find_indexed_paths(cursor, hashes, chunk_size=DEDUP_CHUNK_SIZE):
+    hashes = list(dict.fromkeys(hashes))
+    paths = {}
+    for i in range(0, len(hashes), chunk_size):
+        chunk = [to_key(image_hash) for image_hash in hashes[i:i + chunk_size]]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT id, path FROM image_index WHERE id IN ({placeholders})", chunk)
+        paths.update((to_hex(image_id), path) for image_id, path in cursor.fetchall())
+    return paths
+
+# 将 (元素, 哈希值) 列表分为需要保留的和重复的，同一批次内内容相同的文件只保留第一个
+def split_duplicates(items, existing_hashes):
+    seen = set(existing_hashes)
+    unique, duplicates = [], []
+    for item, item_hash in items:
+        if item_hash in seen:
+            duplicates.append(item)
+        else:
+            seen.add(item_hash)
+            unique.append(item)
+    return unique, duplicates
 
 # 创建 image_index 表（如果不存在的话）
 def create_image_index_table_if_not_exists():
@@ -28,7 +54,7 @@ def create_image_index_table_if_not_exists():
         cursor = conn.cursor()
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS image_index (
-            id CHAR(64) NOT NULL,
+            id BINARY(32) NOT NULL,
             path VARCHAR(255) NOT NULL,
             size_in_mb FLOAT,
             PRIMARY KEY (id)
@@ -43,34 +69,43 @@ def create_image_index_table_if_not_exists():
             cursor.close()
             conn.close()
 
-# 递归移动文件的函数
-def move_files_recursively(src, dst, found_non_duplicate=False):
+# 递归收集目录下的文件，返回 (源路径, 目标路径) 列表
+def collect_files(src, dst):
     if os.path.isfile(src):
-        file_hash = compute_file_hash(src)
-        try:
-            conn = mysql.connector.connect(**db_config)
-            cursor = conn.cursor()
-            if is_hash_in_db(cursor, file_hash):
-                os.remove(src)
-                logging.info(f"检测到重复文件。已删除: {src}")
-            else:
-                shutil.move(src, dst)
-                logging.info(f"移动文件: {src} 到 {dst}")
-                found_non_duplicate = True
-            conn.commit()
-        except Error as e:
-            logging.info(f"连接 MySQL 时出错: {e}")
-        finally:
-            if conn.is_connected():
-                cursor.close()
-                conn.close()
-    elif os.path.isdir(src):
-        os.makedirs(dst, exist_ok=True)
+        return [(src, dst)] if is_staged_file(os.path.basename(src)) else []
+    files = []
+    if os.path.isdir(src):
         for item in os.listdir(src):
-            src_item = os.path.join(src, item)
-            dst_item = os.path.join(dst, item)
-            found_non_duplicate = move_files_recursively(src_item, dst_item, found_non_duplicate)
-    return found_non_duplicate
+            files.extend(collect_files(os.path.join(src, item), os.path.join(dst, item)))
+    return files
+
+# 递归移动文件的函数：先计算整批文件的哈希值，再用一个连接批量查重
+def move_files_recursively(src, dst):
+    files = collect_files(src, dst)
+    hashed_files = [((src_path, dst_path), compute_file_hash(src_path)) for src_path, dst_path in files]
+
+    conn = None
+    try:
+        conn = mysql.connector.connect(**db_config)
+        cursor = conn.cursor()
+        existing_hashes = find_existing_hashes(cursor, [file_hash for _, file_hash in hashed_files])
+        cursor.close()
+    except Error as e:
+        logging.info(f"连接 MySQL 时出错: {e}")
+        return False
+    finally:
+        if conn and conn.is_connected():
+            conn.close()
+
+    unique, duplicates = split_duplicates(hashed_files, existing_hashes)
+    for src_path, _ in duplicates:
+        os.remove(src_path)
+        logging.info(f"检测到重复文件。已删除: {src_path}")
+    for src_path, dst_path in unique:
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        shutil.move(src_path, dst_path)
+        logging.info(f"移动文件: {src_path} 到 {dst_path}")
+    return bool(unique)
 
 # 删除空目录
 def delete_empty_directories(path):
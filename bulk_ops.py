@@ -0,0 +1,282 @@
+import logging
+import os
+
+from mysql.connector import Error
+
+from config import BULK_MAX_ITEMS
+from db_pool import get_connection
+from image_keys import to_key, to_hex, from_db
+from tag_index import add_tags_to_images
+
+
+def parse_bulk_items(data):
+    """
+    读取批量操作的请求体，图片可以按哈希值（ids）或压缩图路径（paths）指定，两者可同时提供。
+
+    参数:
+        data (dict): 请求体 JSON。
+
+    返回:
+        list: 每个元素是 ("id", 哈希值) 或 ("path", 压缩图路径)，已去重并保持顺序。
+
+    异常:
+        ValueError: ids/paths 不是字符串列表、为空或超过 BULK_MAX_ITEMS。
+    """
+    items = []
+    for field, kind in (('ids', 'id'), ('paths', 'path')):
+        values = data.get(field, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) and value for value in values):
+            raise ValueError(f"{field} must be a list of non-empty strings")
+        # 哈希值按小写十六进制比较
+        items.extend((kind, value.lower() if kind == 'id' else value) for value in values)
+    items = list(dict.fromkeys(items))
+    if not items:
+        raise ValueError("ids or paths is required")
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(f"At most {BULK_MAX_ITEMS} images per request")
+    return items
+
+
+def resolve_images(cursor, items):
+    """
+    一次查询将请求中的哈希值和路径对应到图片哈希值。
+
+    参数:
+        cursor: MySQL 游标。
+        items (list): parse_bulk_items 的返回值。
+
+    返回:
+        dict: {("id"|"path", 值): 图片主键（BINARY(32)）}，数据库中不存在的图片和格式不正确的哈希值不包含在内。
+    """
+    keys = {}
+    for kind, value in items:
+        if kind == 'id':
+            try:
+                keys[to_key(value)] = value
+            except ValueError:
+                pass
+    ids = list(keys) or [None]
+    paths = [value for kind, value in items if kind == 'path'] or [None]
+    cursor.execute(f'''
+        SELECT id, compressed_path FROM image_compression_index
+        WHERE id IN ({', '.join(['%s'] * len(ids))}) OR compressed_path IN ({', '.join(['%s'] * len(paths))})
+    ''', ids + paths)
+    resolved = {}
+    for image_id, compressed_path in cursor.fetchall():
+        image_id = from_db(image_id)
+        if image_id in keys:
+            resolved[('id', keys[image_id])] = image_id
+        resolved[('path', compressed_path)] = image_id
+    return resolved
+
+
+# 生成单项结果，按请求时的方式（id 或 path）标识图片
+def item_result(item, success, message):
+    kind, value = item
+    return {kind: value, "success": success, "message": message}
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def set_trash_type(cursor, items, image_type):
+    """
+    批量将图片移入回收站（image_type=1）或恢复到主页（image_type=0）。
+
+    参数:
+        cursor: MySQL 游标，调用方负责提交事务。
+        items (list): parse_bulk_items 的返回值。
+        image_type (int): 目标类型。
+
+    返回:
+        tuple: (每项结果列表, 实际改变状态的图片数)。
+    """
+    resolved = resolve_images(cursor, items)
+    image_ids = list(dict.fromkeys(resolved.values()))
+    current = {}
+    if image_ids:
+        cursor.execute(f"SELECT id, type FROM trash WHERE id IN ({_placeholders(image_ids)}) FOR UPDATE", image_ids)
+        current = {from_db(image_id): current_type for image_id, current_type in cursor.fetchall()}
+    to_change = [image_id for image_id in image_ids if image_id in current and current[image_id] != image_type]
+    if to_change:
+        # 移入回收站时记录时间，用于按保留天数自动清理
+        trashed_at = "NOW()" if image_type == 1 else "NULL"
+        cursor.execute(f"UPDATE trash SET type = %s, trashed_at = {trashed_at} WHERE id IN ({_placeholders(to_change)})",
+                       [image_type] + to_change)
+
+    done = "Image marked as deleted" if image_type == 1 else "Image recovered"
+    results = []
+    for item in items:
+        image_id = resolved.get(item)
+        if image_id not in current:
+            results.append(item_result(item, False, "Image not found in database"))
+        elif image_id in to_change:
+            results.append(item_result(item, True, done))
+        else:
+            results.append(item_result(item, True, "Image already in requested state"))
+    return results, len(to_change)
+
+
+def destroy_images(cursor, items):
+    """
+    批量彻底删除回收站中的图片记录，每张表只执行一条 DELETE。
+
+    文件不在这里删除：调用方提交事务后再调用 remove_files，避免回滚后文件已丢失。
+
+    参数:
+        cursor: MySQL 游标，调用方负责提交事务。
+        items (list): parse_bulk_items 的返回值。
+
+    返回:
+        tuple: (每项结果列表, 待删除的文件路径列表, {标签名: 减少的使用次数})。
+    """
+    resolved = resolve_images(cursor, items)
+    image_ids = list(dict.fromkeys(resolved.values()))
+    in_trash = set()
+    if image_ids:
+        cursor.execute(f"SELECT id FROM trash WHERE type = 1 AND id IN ({_placeholders(image_ids)}) FOR UPDATE",
+                       image_ids)
+        in_trash = {from_db(row[0]) for row in cursor.fetchall()}
+    targets = [image_id for image_id in image_ids if image_id in in_trash]
+
+    file_paths, removed_tags = [], {}
+    if targets:
+        ids = _placeholders(targets)
+        cursor.execute(f'''
+            SELECT ic.compressed_path, ii.path FROM image_compression_index ic
+            LEFT JOIN image_index ii ON ii.id = ic.id
+            WHERE ic.id IN ({ids})
+        ''', targets)
+        for compressed_path, original_path in cursor.fetchall():
+            file_paths.extend(path for path in (compressed_path, original_path) if path)
+        cursor.execute(f"SELECT path FROM image_rendition WHERE id IN ({ids})", targets)
+        file_paths.extend(row[0] for row in cursor.fetchall())
+        cursor.execute(f'''
+            SELECT t.name, COUNT(*) FROM image_tag it
+            JOIN tag t ON t.tag_id = it.tag_id
+            WHERE it.image_id IN ({ids})
+            GROUP BY t.tag_id, t.name
+        ''', targets)
+        removed_tags = dict(cursor.fetchall())
+
+        # image_tag 随 image_compression_index 级联删除
+        for table in ("trash", "image_index", "image_exif_index", "image_rendition", "image_compression_index"):
+            cursor.execute(f"DELETE FROM {table} WHERE id IN ({ids})", targets)
+        logging.info(f"已从数据库彻底删除 {len(targets)} 张图片")
+
+    results = []
+    for item in items:
+        image_id = resolved.get(item)
+        if image_id is None:
+            results.append(item_result(item, False, "Image not found in database"))
+        elif image_id not in in_trash:
+            results.append(item_result(item, False, "Image not found in trash"))
+        else:
+            results.append(item_result(item, True, "Image and all related records have been permanently deleted"))
+    return results, list(dict.fromkeys(file_paths)), removed_tags
+
+
+def tag_images(cursor, items, names):
+    """
+    批量为图片添加标签。
+
+    参数:
+        cursor: MySQL 游标，调用方负责提交事务。
+        items (list): parse_bulk_items 的返回值。
+        names (list): 标签名列表。
+
+    返回:
+        tuple: (每项结果列表, {标签名: 新增关联的图片数})。
+    """
+    resolved = resolve_images(cursor, items)
+    added = add_tags_to_images(cursor, list(resolved.values()), names)
+    results = [
+        item_result(item, True, "Tag added successfully") if item in resolved
+        else item_result(item, False, "Image not found in database")
+        for item in items
+    ]
+    return results, added
+
+
+def purge_trash_batch(cursor, batch_size, trashed_before=None):
+    """
+    彻底删除回收站中最多 batch_size 张图片的记录，先删除移入回收站最早的图片。
+
+    参数:
+        cursor: MySQL 游标，调用方负责提交事务。
+        batch_size (int): 本批最多删除的图片数。
+        trashed_before (datetime): 只删除在此之前移入回收站的图片，为 None 时不限制。
+
+    返回:
+        tuple: (本批查到的图片数, 实际删除的图片数, 待删除的文件路径列表, {标签名: 减少的使用次数})。
+    """
+    # 按 (type, trashed_at) 索引查找
+    if trashed_before is None:
+        cursor.execute("SELECT id FROM trash WHERE type = 1 ORDER BY trashed_at LIMIT %s", (batch_size,))
+    else:
+        cursor.execute("SELECT id FROM trash WHERE type = 1 AND trashed_at < %s ORDER BY trashed_at LIMIT %s",
+                       (trashed_before, batch_size))
+    items = [('id', to_hex(row[0])) for row in cursor.fetchall()]
+    if not items:
+        return 0, 0, [], {}
+    results, file_paths, removed_tags = destroy_images(cursor, items)
+    return len(items), sum(1 for result in results if result["success"]), file_paths, removed_tags
+
+
+def purge_trash(batch_size, on_batch=None, trashed_before=None):
+    """
+    按批清空回收站，每批一个事务，提交后再删除该批的文件。
+
+    参数:
+        batch_size (int): 每批删除的图片数。
+        on_batch (callable): 每批提交后调用 on_batch(累计删除数, 累计删除的文件字节数, {标签名: 减少的使用次数})。
+        trashed_before (datetime): 只删除在此之前移入回收站的图片，为 None 时清空整个回收站。
+
+    返回:
+        int: 删除的图片总数。
+
+    异常:
+        mysql.connector.Error: 数据库出错，已提交的批次不会回滚。
+    """
+    destroyed = 0
+    freed_bytes = 0
+    while True:
+        conn = get_connection()
+        cursor = None
+        try:
+            cursor = conn.cursor()
+            found, count, file_paths, removed_tags = purge_trash_batch(cursor, batch_size, trashed_before)
+            conn.commit()
+        except Error:
+            conn.rollback()
+            raise
+        finally:
+            if cursor is not None:
+                cursor.close()
+            conn.close()  # 归还连接池
+
+        destroyed += count
+        freed_bytes += remove_files(file_paths)[1]
+        if on_batch is not None:
+            on_batch(destroyed, freed_bytes, removed_tags)
+        if found < batch_size:
+            logging.info(f"回收站清理完成，共删除 {destroyed} 张图片，释放 {freed_bytes} 字节")
+            return destroyed
+
+
+# 删除图片文件（压缩图、原图和各尺寸版本），文件不存在时跳过，返回 (删除的文件数, 字节数)
+def remove_files(paths):
+    removed = 0
+    removed_bytes = 0
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            removed += 1
+            removed_bytes += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.info(f"删除文件 {path} 失败: {e}")
+    return removed, removed_bytes
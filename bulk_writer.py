@@ -0,0 +1,94 @@
+import logging
+
+from mysql.connector import Error
+
+from config import INSERT_BATCH_SIZE
+
+
+class BulkWriter:
+    """
+    缓存待插入的行，按批次以多行 INSERT ... ON DUPLICATE KEY UPDATE 写入。
+
+    每个批次一条语句、一次提交，避免逐行往返数据库。
+    同一连接上有外键依赖的多个 BulkWriter，需要先 flush 被引用的表。
+    指定 on_error 时，批次写入失败后逐行重试，只有出错的行被跳过并交给 on_error 处理。
+    """
+
+    def __init__(self, conn, table, columns, update_columns=(), batch_size=INSERT_BATCH_SIZE, on_error=None):
+        """
+        参数:
+            conn: MySQL 连接。
+            table (str): 表名。
+            columns (tuple): 插入的列名。
+            update_columns (tuple): 主键冲突时更新的列名，为空时保留已有的行。
+            batch_size (int): 每批写入的行数。
+            on_error (callable): 单行写入失败时调用 on_error(source, 异常)，source 为 add 时传入的值；
+                为 None 时批次失败直接抛出异常。
+        """
+        self.conn = conn
+        self.table = table
+        self.columns = tuple(columns)
+        self.update_columns = tuple(update_columns)
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.rows = []
+        self.sources = []
+        self.rows_written = 0
+        self.failed = []  # 写入失败的行对应的 source
+
+    # source 用于标识出错的行，例如流水线中的图片记录
+    def add(self, row, source=None):
+        self.rows.append(tuple(row))
+        self.sources.append(source)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def _build_query(self, row_count):
+        placeholders = "(" + ", ".join(["%s"] * len(self.columns)) + ")"
+        query = f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES " + ", ".join([placeholders] * row_count)
+        # 没有需要更新的列时，用主键自赋值忽略冲突
+        update_columns = self.update_columns or self.columns[:1]
+        return query + " ON DUPLICATE KEY UPDATE " + ", ".join(f"{column} = VALUES({column})" for column in update_columns)
+
+    # 执行一条多行 INSERT 并提交，失败时回滚后抛出异常
+    def _write(self, rows):
+        params = [value for row in rows for value in row]
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(self._build_query(len(rows)), params)
+            self.conn.commit()
+            self.rows_written += len(rows)
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def flush(self):
+        if not self.rows:
+            return
+        rows, self.rows = self.rows, []
+        sources, self.sources = self.sources, []
+        try:
+            self._write(rows)
+            return
+        except Error as e:
+            logging.info(f"批量写入 {self.table} 失败（{len(rows)} 行）: {e}")
+            if self.on_error is None:
+                raise
+        # 逐行重试，一行数据不合法不影响同批的其他行
+        for row, source in zip(rows, sources):
+            try:
+                self._write([row])
+            except Error as e:
+                logging.info(f"逐行写入 {self.table} 失败: {e}")
+                self.failed.append(source)
+                self.on_error(source, e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        return False
@@ -14,6 +14,76 @@ db_config = {
     'password': '88188818'
 }
 
+# MySQL 连接池配置（每个进程一个连接池）
+DB_POOL_SIZE = 10  # Web 进程的连接数，mysql-connector 的上限为 32
+DB_WORKER_POOL_SIZE = 2  # 每个 Celery worker 子进程的连接数（同一时间只处理一个任务）
+DB_POOL_CHECKOUT_TIMEOUT = 10  # 连接池用完时等待空闲连接的最长时间（秒）
+
+# 文件哈希缓存配置（SQLite 文件，按 (device, inode, size, mtime_ns) 缓存 SHA-256）
+HASH_CACHE_PATH = os.path.join(os.getcwd(), 'hash_cache.sqlite3')
+HASH_CACHE_MAX_AGE = 7 * 24 * 60 * 60  # 缓存记录的保留时间（秒）；缓存只在上传到入库扫描之间使用，过期记录定期删除
+HASH_CACHE_PRUNE_INTERVAL = 60 * 60  # 每个进程删除过期记录的最小间隔（秒）
+HASH_READ_SIZE = 1024 * 1024  # 计算哈希时每次读取 1MB
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # 上传文件写入暂存目录时每次读取 1MB
+
+# 上传暂存目录清理配置：Celery beat 定时删除长时间没有写入的暂存目录（放弃的分块上传会话、未能提交入库的批次）
+UPLOAD_STAGING_TTL = 24 * 60 * 60  # 暂存目录最后一次写入后的保留时间（秒）
+UPLOAD_SWEEP_INTERVAL = 60 * 60  # 检查间隔（秒）
+
+# 入库时批量写入数据库的每批行数
+INSERT_BATCH_SIZE = 500
+
+# 入库进度配置：各 worker 的进度汇总在 Redis 中，通过 SocketIO 消息队列推送给前端
+PROGRESS_REDIS_URL = CELERY_BROKER_URL
+SOCKETIO_MESSAGE_QUEUE = CELERY_BROKER_URL
+PROGRESS_TTL = 24 * 60 * 60  # 进度记录保留时间（秒）
+PROGRESS_EMIT_INTERVAL = 0.5  # 同一进程推送进度的最小间隔（秒），阶段切换时立即推送
+
+# 标签与搜索配置
+TAG_MAX_LENGTH = 191  # 标签最大长度（utf8mb4 下唯一索引的安全长度）
+FILENAME_NGRAM_SIZE = 2  # 与 MySQL 的 ngram_token_size 一致，更短的关键词不使用文件名全文索引
+TAG_SUGGEST_LIMIT = 10  # 标签自动补全默认返回的数量
+TAG_SUGGEST_REDIS_URL = CELERY_BROKER_URL  # worker 通过 Redis 发布标签使用次数的变化，Web 进程订阅后更新自动补全索引
+
+# 图片列表分页配置（主页、回收站、搜索）
+LISTING_PAGE_SIZE = 100  # 默认每页数量
+LISTING_MAX_PAGE_SIZE = 500  # 每页数量上限
+
+# 图片列表响应缓存配置：图片或标签变化时更新缓存代数，旧缓存不再使用
+RESPONSE_CACHE_REDIS_URL = CELERY_BROKER_URL
+RESPONSE_CACHE_TTL = 10 * 60  # 缓存保留时间（秒）
+
+# 批量操作（删除、恢复、彻底删除、添加标签）每次请求最多处理的图片数
+BULK_MAX_ITEMS = 5000
+TRASH_PURGE_BATCH_SIZE = 200  # 清空回收站时每个事务删除的图片数，避免长时间持有行锁
+
+# 回收站自动清理配置：Celery beat 定时彻底删除移入回收站超过保留天数的图片
+TRASH_RETENTION_DAYS = 30  # 保留天数，设为 0 则不自动清理
+TRASH_PURGE_INTERVAL = 60 * 60  # 检查间隔（秒）
+TRASH_PURGE_ROWS_PER_SECOND = 50  # 每秒最多删除的图片数，避免与入库争用数据库
+TRASH_PURGE_BYTES_PER_SECOND = 20 * 1024 * 1024  # 每秒最多删除的文件字节数，避免与入库争用磁盘
+
+# 分布式入库配置：准备阶段完成后，图片按分块分发给多个 Celery worker 处理
+INGEST_CHUNK_SIZE = 20  # 每个任务处理的图片数，设为 1 则每张图片一个任务
+INGEST_MAX_RETRIES = 3  # 单个任务失败后的最大重试次数
+INGEST_RETRY_DELAY = 10  # 重试间隔（秒）
+QUARANTINE_FOLDER = os.path.join(os.getcwd(), 'quarantine')  # 放弃处理的原图移到此目录，不留在 images 中
+
+# 压缩图生成配置
+THUMBNAIL_WORKERS = os.cpu_count() or 1  # 独立运行脚本时的进程池大小，设为 1 则在当前进程内逐张处理
+# Celery worker 每个子进程的进程池大小：worker 默认按 CPU 核数启动子进程，已占满所有核心，
+# 因此默认在子进程内逐张处理；调小 worker 的 --concurrency 后可相应调大，两者之积不应超过核数
+WORKER_THUMBNAIL_WORKERS = 1
+THUMBNAIL_MAX_IN_FLIGHT = THUMBNAIL_WORKERS * 2  # 同时提交到进程池的最大任务数，避免占用过多内存
+THUMBNAIL_MAX_EDGE = 512  # 压缩图最长边的像素数
+
+# 每张图片生成的多尺寸版本（名称: 最长边像素数），grid 即首页使用的压缩图
+RENDITION_SIZES = {
+    'grid': THUMBNAIL_MAX_EDGE,
+    'preview': 1280,
+    'full': 2560,
+}
+
 # 此函数用于配置日志
 def setup_logging():
     logger = logging.getLogger()
@@ -0,0 +1,122 @@
+import logging
+import os
+import threading
+import time
+
+from mysql.connector import Error, pooling
+
+from config import db_config, DB_POOL_SIZE, DB_POOL_CHECKOUT_TIMEOUT
+
+_pool_size = DB_POOL_SIZE
+_pool = None
+_pool_pid = None
+_slots = None
+_init_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {"checkouts": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+
+class PoolTimeout(Error):
+    """在等待时间内没有空闲的数据库连接。"""
+
+
+class PooledConnection:
+    """
+    从连接池取出的连接，close() 时归还到连接池。
+
+    其余属性和方法（cursor、commit、rollback 等）直接转发给底层连接。
+    """
+
+    def __init__(self, conn, slots):
+        self._conn = conn
+        self._slots = slots
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            conn.close()  # 归还连接池，断开的连接会在下次取出时重连
+        except Error as e:
+            logging.info(f"归还数据库连接时出错: {e}")
+        finally:
+            self._slots.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+# 设置当前进程的连接池大小，需在第一次取连接之前调用（连接池创建时即建立全部连接）
+def configure(pool_size):
+    global _pool_size
+    _pool_size = pool_size
+
+
+# 获取当前进程的连接池（Celery 会 fork 子进程，每个进程使用自己的连接池）
+def _get_pool():
+    global _pool, _pool_pid, _slots
+    if _pool is None or _pool_pid != os.getpid():
+        with _init_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = pooling.MySQLConnectionPool(
+                    pool_name=f"qpm_{os.getpid()}",
+                    pool_size=_pool_size,
+                    pool_reset_session=True,
+                    **db_config
+                )
+                _slots = threading.BoundedSemaphore(_pool_size)
+                _pool_pid = os.getpid()
+    return _pool, _slots
+
+
+def get_connection(timeout=DB_POOL_CHECKOUT_TIMEOUT):
+    """
+    从连接池取出一个连接，连接池用完时最多等待 timeout 秒。
+
+    取出时连接池会检查连接是否可用，断开的连接自动重连。
+
+    参数:
+        timeout (float): 最长等待时间（秒）。
+
+    返回:
+        PooledConnection: 用完后调用 close() 归还。
+
+    异常:
+        PoolTimeout: 等待超时。
+    """
+    pool, slots = _get_pool()
+    start = time.perf_counter()
+    acquired = slots.acquire(timeout=timeout)
+    waited = time.perf_counter() - start
+    with _stats_lock:
+        _stats["wait_total"] += waited
+        _stats["wait_max"] = max(_stats["wait_max"], waited)
+        if acquired:
+            _stats["checkouts"] += 1
+        else:
+            _stats["timeouts"] += 1
+    if not acquired:
+        raise PoolTimeout(msg=f"No database connection available after {timeout}s")
+
+    try:
+        return PooledConnection(pool.get_connection(), slots)
+    except BaseException:
+        slots.release()
+        raise
+
+
+# 获取连接池的等待统计
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    requests = stats["checkouts"] + stats["timeouts"]
+    stats["wait_avg"] = stats["wait_total"] / requests if requests else 0.0
+    stats["pool_size"] = _pool_size
+    return stats
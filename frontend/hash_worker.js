@@ -0,0 +1,126 @@
+// 在 Web Worker 中计算文件的 SHA-256，不阻塞页面
+// 消息格式：收到 {id, file}，返回 {id, hash} 或 {id, error}
+
+const READ_SIZE = 4 * 1024 * 1024;
+
+const K = new Uint32Array([
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+]);
+
+// 可分段输入的 SHA-256；页面不是 HTTPS 时浏览器不提供 crypto.subtle，用它逐块计算大文件
+class Sha256 {
+    constructor() {
+        this.state = new Uint32Array([
+            0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19
+        ]);
+        this.buffer = new Uint8Array(64);
+        this.bufferLength = 0;
+        this.bytes = 0;
+        this.w = new Uint32Array(64);
+    }
+
+    update(data) {
+        let i = 0;
+        this.bytes += data.length;
+        if (this.bufferLength > 0) {
+            i = Math.min(64 - this.bufferLength, data.length);
+            this.buffer.set(data.subarray(0, i), this.bufferLength);
+            this.bufferLength += i;
+            if (this.bufferLength < 64) {
+                return;
+            }
+            this.block(this.buffer, 0);
+            this.bufferLength = 0;
+        }
+        for (; i + 64 <= data.length; i += 64) {
+            this.block(data, i);
+        }
+        this.buffer.set(data.subarray(i), 0);
+        this.bufferLength = data.length - i;
+    }
+
+    block(data, offset) {
+        const w = this.w;
+        for (let t = 0; t < 16; t++) {
+            const j = offset + t * 4;
+            w[t] = (data[j] << 24) | (data[j + 1] << 16) | (data[j + 2] << 8) | data[j + 3];
+        }
+        for (let t = 16; t < 64; t++) {
+            const x = w[t - 15];
+            const y = w[t - 2];
+            const s0 = ((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3);
+            const s1 = ((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10);
+            w[t] = (w[t - 16] + s0 + w[t - 7] + s1) | 0;
+        }
+
+        let [a, b, c, d, e, f, g, h] = this.state;
+        for (let t = 0; t < 64; t++) {
+            const S1 = ((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7));
+            const ch = (e & f) ^ (~e & g);
+            const t1 = (h + S1 + ch + K[t] + w[t]) | 0;
+            const S0 = ((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10));
+            const maj = (a & b) ^ (a & c) ^ (b & c);
+            const t2 = (S0 + maj) | 0;
+            h = g;
+            g = f;
+            f = e;
+            e = (d + t1) | 0;
+            d = c;
+            c = b;
+            b = a;
+            a = (t1 + t2) | 0;
+        }
+        const state = this.state;
+        state[0] += a;
+        state[1] += b;
+        state[2] += c;
+        state[3] += d;
+        state[4] += e;
+        state[5] += f;
+        state[6] += g;
+        state[7] += h;
+    }
+
+    hexdigest() {
+        const bytes = this.bytes;
+        const padding = new Uint8Array((this.bufferLength < 56 ? 56 : 120) - this.bufferLength + 8);
+        const view = new DataView(padding.buffer);
+        padding[0] = 0x80;
+        view.setUint32(padding.length - 8, Math.floor(bytes / 0x20000000));
+        view.setUint32(padding.length - 4, (bytes << 3) >>> 0);
+        this.update(padding);
+        return Array.from(this.state, word => word.toString(16).padStart(8, '0')).join('');
+    }
+}
+
+function toHex(buffer) {
+    return Array.from(new Uint8Array(buffer), byte => byte.toString(16).padStart(2, '0')).join('');
+}
+
+async function hashFile(file) {
+    if (self.crypto && self.crypto.subtle) {
+        return toHex(await self.crypto.subtle.digest('SHA-256', await file.arrayBuffer()));
+    }
+    const sha256 = new Sha256();
+    const reader = new FileReaderSync();
+    for (let offset = 0; offset < file.size; offset += READ_SIZE) {
+        sha256.update(new Uint8Array(reader.readAsArrayBuffer(file.slice(offset, offset + READ_SIZE))));
+    }
+    return sha256.hexdigest();
+}
+
+self.onmessage = async event => {
+    const { id, file } = event.data;
+    try {
+        self.postMessage({ id, hash: await hashFile(file) });
+    } catch (error) {
+        self.postMessage({ id, error: String(error) });
+    }
+};
@@ -1,40 +1,97 @@
 import logging
+from urllib.parse import quote
 
-import mysql.connector
 from mysql.connector import Error
-from config import db_config
+from db_pool import get_connection
+from image_keys import to_hex, from_db
+
+
+# 将数据库中的相对路径（images/...、compressed/...）转换为可直接访问的 URL
+def image_url(path):
+    return '/' + quote(path.replace('\\', '/').lstrip('/'))
 
 
 def get_original_image_path(compressed_path):
+    conn = None
+    cursor = None
     try:
-        # 连接到 MySQL 数据库
-        conn = mysql.connector.connect(**db_config)
+        # 从连接池取出连接
+        conn = get_connection()
         cursor = conn.cursor()
 
-        # 根据压缩路径查询对应的 ID
+        # 根据压缩路径一次查询对应的原图路径
         cursor.execute('''
-            SELECT id FROM image_compression_index
-            WHERE compressed_path = %s
+            SELECT ii.path FROM image_compression_index ic
+            JOIN image_index ii ON ii.id = ic.id
+            WHERE ic.compressed_path = %s
         ''', (compressed_path,))
         result = cursor.fetchone()
-        if not result:
-            return None
-
-        id = result[0]
-
-        # 使用 ID 查询原图路径
-        cursor.execute('''
-            SELECT path FROM image_index
-            WHERE id = %s
-        ''', (id,))
-        result = cursor.fetchone()
 
         return result[0] if result else None
 
     except Error as e:
-        logging.info("连接 MySQL 时出错", e)
+        logging.info(f"连接 MySQL 时出错: {e}")
         return None
     finally:
-        if conn and conn.is_connected():
+        if cursor is not None:
             cursor.close()
-            conn.close()
\ No newline at end of file
+        if conn is not None:
+            conn.close()  # 归还连接池
+
+
+def get_originals_by_paths(cursor, compressed_paths):
+    """
+    批量查询多张压缩图对应的原图。
+
+    参数:
+        cursor: MySQL 游标。
+        compressed_paths (list): 压缩图路径列表。
+
+    返回:
+        dict: {压缩图路径: {"id": 十六进制哈希值, "original_path": 原图路径, "original_url": 原图 URL}}，
+        查不到的路径不包含在内。
+    """
+    compressed_paths = list(dict.fromkeys(compressed_paths))
+    if not compressed_paths:
+        return {}
+    placeholders = ', '.join(['%s'] * len(compressed_paths))
+    cursor.execute(f'''
+        SELECT ic.compressed_path, ic.id, ii.path FROM image_compression_index ic
+        JOIN image_index ii ON ii.id = ic.id
+        WHERE ic.compressed_path IN ({placeholders})
+    ''', compressed_paths)
+    return {
+        compressed_path: {"id": to_hex(image_id), "original_path": path, "original_url": image_url(path)}
+        for compressed_path, image_id, path in cursor.fetchall()
+    }
+
+
+def get_image_details(cursor, image_ids):
+    """
+    批量查询多张图片的原图和多尺寸版本，用于列表接口，前端打开大图时不需要再请求接口。
+
+    参数:
+        cursor: MySQL 游标。
+        image_ids (list): 图片主键列表。
+
+    返回:
+        dict: {图片主键: {"original_url": 原图 URL 或 None, "size_in_mb": 原图大小,
+        "renditions": [{"url", "width", "height"}, ...]}}，renditions 按尺寸从小到大排列。
+    """
+    details = {image_id: {"original_url": None, "size_in_mb": None, "renditions": []} for image_id in image_ids}
+    if not details:
+        return details
+    placeholders = ', '.join(['%s'] * len(details))
+    cursor.execute(f"SELECT id, path, size_in_mb FROM image_index WHERE id IN ({placeholders})", list(details))
+    for image_id, path, size_in_mb in cursor.fetchall():
+        image_id = from_db(image_id)
+        details[image_id]["original_url"] = image_url(path)
+        details[image_id]["size_in_mb"] = size_in_mb
+    cursor.execute(f'''
+        SELECT id, path, width, height FROM image_rendition
+        WHERE id IN ({placeholders})
+        ORDER BY id, GREATEST(width, height)
+    ''', list(details))
+    for image_id, path, width, height in cursor.fetchall():
+        details[from_db(image_id)]["renditions"].append({"url": image_url(path), "width": width, "height": height})
+    return details
@@ -0,0 +1,143 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import HASH_CACHE_PATH, HASH_READ_SIZE, HASH_CACHE_MAX_AGE, HASH_CACHE_PRUNE_INTERVAL
+
+# 本进程内的缓存命中统计
+_stats = {"hits": 0, "misses": 0}
+_lock = threading.Lock()  # 保护缓存连接和命中统计
+_conn = None
+_conn_pid = None
+_last_prune = None  # 本进程上次删除过期记录的时间
+
+
+# 获取缓存数据库连接（Celery 会 fork 子进程，每个进程使用自己的连接）
+def _get_conn():
+    global _conn, _conn_pid
+    if _conn is None or _conn_pid != os.getpid():
+        _conn = sqlite3.connect(HASH_CACHE_PATH, timeout=30, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute('''
+            CREATE TABLE IF NOT EXISTS file_hash (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                stored_at INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (device, inode, size, mtime_ns)
+            )
+        ''')
+        # 旧的缓存文件没有 stored_at 列，补上后原有记录在下次清理时删除
+        columns = {row[1] for row in _conn.execute("PRAGMA table_info(file_hash)")}
+        if 'stored_at' not in columns:
+            _conn.execute("ALTER TABLE file_hash ADD COLUMN stored_at INTEGER NOT NULL DEFAULT 0")
+        _conn.execute("CREATE INDEX IF NOT EXISTS idx_file_hash_stored_at ON file_hash (stored_at)")
+        _conn.commit()
+        _conn_pid = os.getpid()
+    return _conn
+
+
+# 文件的缓存键
+def _cache_key(stat_result):
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+# 以大块读取的方式计算文件的 SHA-256
+def compute_sha256(file_path):
+    hash_sha256 = hashlib.sha256()
+    buffer = bytearray(HASH_READ_SIZE)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            hash_sha256.update(view[:n])
+    return hash_sha256.hexdigest()
+
+
+# 记录已知文件的哈希值（例如上传时边写边算得到的哈希）
+def store_hash(file_path, digest):
+    key = _cache_key(os.stat(file_path))
+    try:
+        with _lock:
+            conn = _get_conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO file_hash (device, inode, size, mtime_ns, sha256, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                key + (digest, int(time.time())),
+            )
+            conn.commit()
+            _prune_if_due(conn)
+    except sqlite3.Error as e:
+        logging.info(f"写入哈希缓存失败: {e}")
+
+
+# 删除超过 HASH_CACHE_MAX_AGE 的记录，每个进程最多每 HASH_CACHE_PRUNE_INTERVAL 秒执行一次；调用方持有 _lock
+# 缓存按 inode 记录，不保存路径，文件移动或删除后无法对应到记录，因此按写入时间清理
+def _prune_if_due(conn):
+    global _last_prune
+    now = time.monotonic()
+    if _last_prune is not None and now - _last_prune < HASH_CACHE_PRUNE_INTERVAL:
+        return
+    _last_prune = now
+    deleted = conn.execute("DELETE FROM file_hash WHERE stored_at < ?", (int(time.time()) - HASH_CACHE_MAX_AGE,)).rowcount
+    conn.commit()
+    if deleted:
+        logging.info(f"已删除 {deleted} 条过期的哈希缓存记录")
+
+
+def file_hash(file_path):
+    """
+    获取文件的 SHA-256，优先从持久化缓存读取。
+
+    参数:
+        file_path (str): 文件路径。
+
+    返回:
+        str: 文件的哈希值（十六进制）。
+    """
+    key = _cache_key(os.stat(file_path))
+    try:
+        with _lock:
+            row = _get_conn().execute(
+                "SELECT sha256 FROM file_hash WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?", key
+            ).fetchone()
+    except sqlite3.Error as e:
+        logging.info(f"读取哈希缓存失败: {e}")
+        row = None
+
+    if row:
+        with _lock:
+            _stats["hits"] += 1
+        return row[0]
+
+    with _lock:
+        _stats["misses"] += 1
+    digest = compute_sha256(file_path)
+    store_hash(file_path, digest)
+    return digest
+
+
+# 获取缓存命中统计
+def get_stats():
+    with _lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+# 重置命中统计（每个批次开始时调用）
+def reset_stats():
+    with _lock:
+        _stats["hits"] = 0
+        _stats["misses"] = 0
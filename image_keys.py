@@ -0,0 +1,22 @@
+# 图片哈希值（SHA-256）在数据库中以 BINARY(32) 存储，程序内部和接口中使用十六进制字符串，
+# 只在读写数据库和返回接口数据时转换
+
+
+# 十六进制哈希值转换为数据库主键，None 原样返回（可为空的列）；格式不正确时抛出 ValueError
+def to_key(hex_hash):
+    if hex_hash is None:
+        return None
+    key = bytes.fromhex(hex_hash)
+    if len(key) != 32:
+        raise ValueError(f"Invalid SHA-256 hex digest: {hex_hash}")
+    return key
+
+
+# 数据库主键转换为十六进制哈希值
+def to_hex(key):
+    return bytes(key).hex()
+
+
+# 规范化从数据库读出的主键（mysql-connector 可能返回 bytearray，不能作为字典键）
+def from_db(value):
+    return None if value is None else bytes(value)
@@ -0,0 +1,175 @@
+import logging
+import time
+
+import redis
+from flask_socketio import SocketIO
+
+from config import PROGRESS_REDIS_URL, PROGRESS_TTL, PROGRESS_EMIT_INTERVAL, SOCKETIO_MESSAGE_QUEUE
+
+# 推送给前端的 SocketIO 事件名
+PROGRESS_EVENT = 'ingest_progress'
+
+_redis = None
+_emitter = None
+_last_emit = {}
+
+
+# 获取 Redis 连接（与 Celery 共用同一个 Redis）
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(PROGRESS_REDIS_URL, decode_responses=True, socket_connect_timeout=2)
+    return _redis
+
+
+# 获取 SocketIO 外部发送端，worker 进程通过消息队列把事件转交给 Web 进程
+def _get_emitter():
+    global _emitter
+    if _emitter is None:
+        _emitter = SocketIO(message_queue=SOCKETIO_MESSAGE_QUEUE)
+    return _emitter
+
+
+# 删除超过推送间隔的记录：批次结束的消息只在一个进程中发送，处理分块的其他 worker 进程也不会一直保留这些批次
+def _prune_last_emit(now):
+    for batch_id in [b for b, emitted in _last_emit.items() if now - emitted >= PROGRESS_EMIT_INTERVAL]:
+        del _last_emit[batch_id]
+
+
+def _key(batch_id):
+    return f"ingest_progress:{batch_id}"
+
+
+def get_progress(batch_id):
+    """
+    读取批次当前阶段的进度，并计算吞吐量和预计剩余时间。
+
+    参数:
+        batch_id (str): 上传批次 ID。
+
+    返回:
+        dict: 进度信息，批次不存在或 Redis 不可用时返回 None。
+    """
+    try:
+        data = _get_redis().hgetall(_key(batch_id))
+    except redis.RedisError as e:
+        logging.info(f"读取入库进度失败: {e}")
+        return None
+    if not data:
+        return None
+
+    total = int(data.get("total", 0))
+    done = int(data.get("done", 0))
+    if total:
+        done = min(done, total)  # 重试的图片会被重复计数
+    bytes_done = int(data.get("bytes_done", 0))
+    elapsed = max(time.time() - float(data.get("started_at", time.time())), 1e-6)
+    images_per_second = done / elapsed
+    remaining = max(total - done, 0)
+    return {
+        "batch_id": batch_id,
+        "stage": data.get("stage"),
+        "done": done,
+        "total": total,
+        "bytes_done": bytes_done,
+        "total_bytes": int(data.get("total_bytes", 0)),
+        "images_per_second": round(images_per_second, 2),
+        "bytes_per_second": round(bytes_done / elapsed),
+        "eta_seconds": round(remaining / images_per_second, 1) if total and images_per_second > 0 else None,
+        # 各阶段累计用时（多个 worker 上的用时相加），用于找出瓶颈阶段
+        "stage_seconds": {
+            field[len("seconds:"):]: round(float(value), 2)
+            for field, value in data.items() if field.startswith("seconds:")
+        },
+    }
+
+
+class ProgressReporter:
+    """
+    将流水线进度汇总到 Redis，并通过 SocketIO 和 Celery 任务状态发布。
+
+    准备阶段和收尾阶段由一个任务执行，负责切换阶段；分块处理图片的任务共用同一个阶段（shared=True），
+    只累加完成数量和阶段用时。Redis 不可用时只记录日志，不影响入库。
+    """
+
+    def __init__(self, batch_id, task=None, shared=False):
+        """
+        参数:
+            batch_id (str): 上传批次 ID。
+            task: 当前的 Celery 任务（bind=True 时的 self），用于 update_state。
+            shared (bool): 是否与其他任务共用当前阶段。
+        """
+        self.batch_id = batch_id
+        self.task = task
+        self.shared = shared
+
+    def stage_started(self, stage, total=0, total_bytes=0):
+        if self.shared:
+            return
+        key = _key(self.batch_id)
+        try:
+            pipe = _get_redis().pipeline()
+            pipe.hset(key, mapping={
+                "stage": stage,
+                "done": 0,
+                "total": total,
+                "bytes_done": 0,
+                "total_bytes": total_bytes,
+                "started_at": time.time(),
+            })
+            pipe.expire(key, PROGRESS_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.info(f"记录入库进度失败: {e}")
+            return
+        self.publish(force=True)
+
+    def items_done(self, count=1, nbytes=0):
+        key = _key(self.batch_id)
+        try:
+            pipe = _get_redis().pipeline()
+            pipe.hincrby(key, "done", count)
+            pipe.hincrby(key, "bytes_done", nbytes)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.info(f"记录入库进度失败: {e}")
+            return
+        self.publish()
+
+    def stage_finished(self, stage, seconds):
+        try:
+            _get_redis().hincrbyfloat(_key(self.batch_id), f"seconds:{stage}", seconds)
+        except redis.RedisError as e:
+            logging.info(f"记录入库进度失败: {e}")
+
+    # 批次结束，status 为 done 或 error
+    def finished(self, status='done'):
+        key = _key(self.batch_id)
+        try:
+            pipe = _get_redis().pipeline()
+            pipe.hset(key, "stage", status)
+            pipe.expire(key, PROGRESS_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logging.info(f"记录入库进度失败: {e}")
+            return
+        self.publish(force=True)
+        _last_emit.pop(self.batch_id, None)
+
+    def publish(self, force=False):
+        now = time.monotonic()
+        if not force and now - _last_emit.get(self.batch_id, 0) < PROGRESS_EMIT_INTERVAL:
+            return None
+        _prune_last_emit(now)
+        _last_emit[self.batch_id] = now
+
+        progress = get_progress(self.batch_id)
+        if progress is None:
+            return None
+        try:
+            _get_emitter().emit(PROGRESS_EVENT, progress)
+        except Exception as e:
+            logging.info(f"推送入库进度失败: {e}")
+        if self.task is not None:
+            self.task.update_state(state='PROGRESS', meta=progress)
+        return progress
@@ -0,0 +1,90 @@
+import base64
+import binascii
+import json
+
+from config import LISTING_PAGE_SIZE, LISTING_MAX_PAGE_SIZE
+from image_keys import to_key, to_hex
+
+
+# 将排序键 (压缩图路径, 图片主键) 编码为不透明的游标字符串，主键以十六进制写入
+def encode_cursor(key):
+    path, image_id = key
+    return base64.urlsafe_b64encode(json.dumps([path, to_hex(image_id)]).encode('utf-8')).decode('ascii')
+
+
+# 解析游标字符串，返回 (压缩图路径, 图片主键)；格式不正确时抛出 ValueError
+def decode_cursor(token):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+    if not isinstance(key, list) or len(key) != 2 or not all(isinstance(value, str) for value in key):
+        raise ValueError(f"Invalid cursor: {token}")
+    try:
+        return key[0], to_key(key[1])
+    except ValueError as e:
+        raise ValueError(f"Invalid cursor: {token}") from e
+
+
+def parse_page_args(args):
+    """
+    从查询参数中读取分页参数。
+
+    参数:
+        args: request.args，cursor 为上一页返回的 next_cursor，limit 为每页数量。
+
+    返回:
+        tuple: (排序键或 None, 每页数量)。
+
+    异常:
+        ValueError: cursor 或 limit 不合法。
+    """
+    limit = args.get('limit', LISTING_PAGE_SIZE, type=int)
+    if limit is None or limit <= 0:
+        raise ValueError("limit must be a positive integer")
+    token = args.get('cursor')
+    return (decode_cursor(token) if token else None), min(limit, LISTING_MAX_PAGE_SIZE)
+
+
+# 生成分页条件：按 (压缩图路径, 哈希值) 倒序，从游标之后开始
+def keyset_condition(path_column, id_column, after):
+    if after is None:
+        return "", []
+    path, image_id = after
+    return f" AND ({path_column} < %s OR ({path_column} = %s AND {id_column} < %s))", [path, path, image_id]
+
+
+# 对应 keyset_condition 的排序
+def keyset_order(path_column, id_column):
+    return f" ORDER BY {path_column} DESC, {id_column} DESC"
+
+
+# 对返回 compressed_path 和 id 两列的子查询分页，多查询一行用于判断是否还有下一页
+def paged_query(subquery, params, after, limit):
+    condition, keyset_params = keyset_condition('m.compressed_path', 'm.id', after)
+    query = (f"SELECT m.compressed_path, m.id FROM ({subquery}) m WHERE 1 = 1{condition}"
+             + keyset_order('m.compressed_path', 'm.id') + " LIMIT %s")
+    return query, list(params) + keyset_params + [limit + 1]
+
+
+def build_page(rows, limit, tags_by_id, details_by_id):
+    """
+    将查询结果转换为响应数据。
+
+    参数:
+        rows (list): 每行为 (压缩图路径, 图片主键)，最多 limit + 1 行。
+        limit (int): 每页数量。
+        tags_by_id (dict): {图片主键: [标签, ...]}。
+        details_by_id (dict): {图片主键: {"original_url": ..., "size_in_mb": ..., "renditions": [...]}}。
+
+    返回:
+        dict: {"images": [...], "next_cursor": 下一页游标或 None}，图片的 id 为十六进制哈希值。
+    """
+    page = rows[:limit]
+    images = [
+        dict(details_by_id.get(image_id, {}), id=to_hex(image_id), compressed_path=compressed_path,
+             tags=tags_by_id.get(image_id, []))
+        for compressed_path, image_id in page
+    ]
+    next_cursor = encode_cursor(page[-1]) if len(rows) > limit else None
+    return {"images": images, "next_cursor": next_cursor}
@@ -0,0 +1,455 @@
+import logging
+import os
+import shutil
+import time
+from datetime import datetime
+
+from PIL import Image
+from mysql.connector import Error, DataError, IntegrityError, ProgrammingError
+
+import CreateThumbnails
+import GetImgInfo
+import GetPath
+import GetThumbnailsPath
+import MoveImg
+import hash_cache
+import rmTemp
+import upload_storage
+from bulk_ops import remove_files
+from config import QUARANTINE_FOLDER, RENDITION_SIZES
+from db_pool import get_connection
+from image_keys import to_key, from_db
+
+
+class ImageRecord:
+    """
+    单个上传文件在流水线中的记录。
+
+    每个文件只读取、哈希和解码一次，所有阶段共享同一份记录。
+    """
+
+    def __init__(self, src_path, relative_path, size_in_bytes, file_hash, original_name=None):
+        self.src_path = src_path  # temp 中的路径
+        self.relative_path = relative_path  # 相对于 temp 的路径
+        self.original_name = original_name or os.path.basename(relative_path)  # 上传时的文件名
+        self.size_in_bytes = size_in_bytes
+        self.hash = file_hash
+        self.path = None  # 移动到 images 后的原图路径
+        self.duplicate = False
+        self.exif = None  # (拍摄时间, GPS坐标)，None 表示该格式不读取EXIF
+        self.compressed_path = None  # 压缩图的完整路径
+        self.compressed_hash = None
+        self.compressed_size_mb = None
+        self.renditions = []  # (尺寸名称, 文件路径, 宽, 高, 大小MB)
+        self.error = None
+        self.transient = False  # error 为数据库或磁盘的临时错误，重试可能成功
+
+    # 分发给 Celery 任务的可序列化数据（文件已移动到 images 之后）
+    def to_task(self):
+        return {"path": self.path, "hash": self.hash, "size_in_bytes": self.size_in_bytes}
+
+    # 从分发的任务数据还原记录
+    @classmethod
+    def from_task(cls, item):
+        record = cls(None, os.path.basename(item["path"]), item["size_in_bytes"], item["hash"])
+        record.path = item["path"]
+        return record
+
+    # 数据库主键（BINARY(32)）
+    @property
+    def key(self):
+        return to_key(self.hash)
+
+    @property
+    def size_in_mb(self):
+        return self.size_in_bytes / (1024 * 1024)
+
+    @property
+    def is_image(self):
+        # 只有 GetPath 中列出的格式才建立索引和压缩图
+        return self.path is not None and GetPath.is_image_file(self.path)
+
+    @property
+    def has_exif(self):
+        return self.path is not None and self.path.lower().endswith(GetImgInfo.exif_extensions)
+
+
+class PipelineContext:
+    """一次上传批次的流水线上下文，在各阶段之间传递。"""
+
+    def __init__(self, batch_id, images_dir='images'):
+        self.batch_id = batch_id
+        self.temp_dir = upload_storage.get_staging_dir(batch_id)  # 本批次独立的暂存目录
+        self.images_dir = images_dir
+        self.folder = None  # 本批次在 images 下创建的文件夹
+        self.records = []
+        self.conn = None
+        self.reporter = None  # ingest_progress.ProgressReporter，为 None 时不记录进度
+
+    def images(self):
+        # 已入库且未出错的图片记录
+        return [record for record in self.records if record.is_image and record.error is None]
+
+    # 记录完成的文件数和字节数
+    def report_items(self, count=1, nbytes=0):
+        if self.reporter is not None:
+            self.reporter.items_done(count, nbytes)
+
+
+# 扫描 temp 目录获取每个文件的哈希；上传时已计算的哈希直接从缓存读取
+def scan_files(ctx):
+    for root, _, files in os.walk(ctx.temp_dir):
+        original_names = upload_storage.read_manifest(root)
+        for file in files:
+            if not upload_storage.is_staged_file(file):
+                continue
+            src_path = os.path.join(root, file)
+            try:
+                size_in_bytes = os.path.getsize(src_path)
+                file_hash = hash_cache.file_hash(src_path)
+            except OSError as e:
+                logging.info(f"读取文件失败 {src_path}: {e}")
+                continue
+            relative_path = os.path.relpath(src_path, ctx.temp_dir)
+            ctx.records.append(ImageRecord(src_path, relative_path, size_in_bytes, file_hash, original_names.get(file)))
+            ctx.report_items(1, size_in_bytes)
+    logging.info(f"扫描到 {len(ctx.records)} 个文件")
+
+
+# 去重并将文件移动到带时间戳的文件夹
+def move_files(ctx):
+    # 文件夹名包含批次 ID，同一秒内开始的多个批次不会混在一起
+    current_time = datetime.now().strftime('%Y%m%d%H%M%S')
+    ctx.folder = os.path.join(ctx.images_dir, f"{current_time}_{ctx.batch_id[:8]}")
+    os.makedirs(ctx.folder, exist_ok=True)
+    logging.info(f"创建文件夹: {ctx.folder}")
+
+    # 整批哈希值一次性查重，同时剔除批次内重复的文件
+    cursor = ctx.conn.cursor()
+    try:
+        existing_hashes = MoveImg.find_existing_hashes(cursor, [record.hash for record in ctx.records])
+    finally:
+        cursor.close()
+    unique, duplicates = MoveImg.split_duplicates([(record, record.hash) for record in ctx.records], existing_hashes)
+
+    # 恢复上传时的文件名，同一批次内重名的文件在内存中编号，不逐个探测磁盘
+    used_names = {}
+    destinations = {}
+    for record in unique:
+        relative_dir = os.path.dirname(record.relative_path)
+        name = upload_storage.unique_name(record.original_name, used_names.setdefault(relative_dir, {}))
+        destinations[record] = os.path.join(ctx.folder, relative_dir, name)
+
+    # 查重和移动之间其他批次可能写入了同一张图片：移动前先以目标路径登记 image_index，
+    # 哈希值已被其他批次登记时保留对方的行，本批次的文件按重复处理
+    claimed = claim_images(ctx, [record for record in unique if GetPath.is_image_file(destinations[record])],
+                           destinations)
+    for record in unique:
+        if record.error is not None:
+            continue
+        if GetPath.is_image_file(destinations[record]) and record not in claimed:
+            duplicates.append(record)
+            continue
+        dst = destinations[record]
+        try:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.move(record.src_path, dst)
+        except OSError as e:
+            record.error = str(e)
+            logging.info(f"移动文件失败 {record.src_path}: {e}")
+            continue
+        record.path = dst
+        logging.info(f"移动文件: {record.src_path} 到 {dst}")
+    release_images([record.to_task() for record in claimed if record.error is not None])
+
+    for record in duplicates:
+        os.remove(record.src_path)
+        record.duplicate = True
+        logging.info(f"检测到重复文件。已删除: {record.src_path}")
+    logging.info(f"共 {len(unique) - len(duplicates)} 个新文件，{len(duplicates)} 个重复文件")
+
+
+# 以目标路径批量登记 image_index，返回登记成功（哈希值此前未被占用）的记录集合
+# 同一哈希值的并发登记由主键保证只有一个成功，其余批次读到的路径不是自己的目标路径
+def claim_images(ctx, records, destinations):
+    with GetPath.image_claim_writer(ctx.conn, record_write_error) as writer:
+        for record in records:
+            writer.add((record.key, destinations[record], record.size_in_mb), record)
+    cursor = ctx.conn.cursor()
+    try:
+        indexed = MoveImg.find_indexed_paths(cursor, [record.hash for record in records if record.error is None])
+    finally:
+        cursor.close()
+    return {record for record in records if record.error is None and indexed.get(record.hash) == destinations[record]}
+
+
+# 删除本批次的暂存目录，不影响其他批次
+def remove_temp(ctx):
+    rmTemp.delete_temp_folder(ctx.temp_dir)
+
+
+# 判断错误是否为临时错误（数据库连接、锁等待、磁盘读写），只有临时错误才值得重试；
+# 无法解码的图片（如 Pillow 不支持的 RAW 格式）和数据错误每次都会失败
+def is_transient_error(error):
+    if isinstance(error, Error):
+        return not isinstance(error, (DataError, IntegrityError, ProgrammingError))
+    # Pillow 的解码错误是不带 errno 的 OSError
+    return isinstance(error, OSError) and error.errno is not None
+
+
+# 批量写入时单行失败的回调：记录错误，后续阶段跳过该图片
+def record_write_error(record, error):
+    record.error = str(error)
+    record.transient = is_transient_error(error)
+    logging.info(f"写入数据库失败 {record.path or record.src_path}: {error}")
+
+
+# 解码一次原图，同时读取EXIF并生成各尺寸版本；在进程池中执行，只返回可序列化的结果
+def render_image(task):
+    image_path, read_exif = task
+    exif = None
+    with Image.open(image_path) as img:
+        if read_exif:
+            exif = (None, None)
+            try:
+                exif = GetImgInfo.summarize_exif(GetImgInfo.extract_exif(img))
+            except Exception as e:
+                logging.info(f"为以下设备获取 EXIF 数据时出错 {image_path}: {e}")
+        renditions = [
+            (name, path, width, height, GetThumbnailsPath.get_file_size_in_mb(path))
+            for name, path, width, height in CreateThumbnails.create_renditions(img, image_path)
+        ]
+    compressed_path = CreateThumbnails.get_rendition_path(image_path, CreateThumbnails.GRID_RENDITION)
+    return {
+        "exif": exif,
+        "renditions": renditions,
+        "compressed_path": compressed_path,
+        "compressed_hash": CreateThumbnails.calculate_file_hash(compressed_path),
+        "compressed_size_mb": GetThumbnailsPath.get_file_size_in_mb(compressed_path),
+    }
+
+
+# 并行生成压缩图，结果写回对应的记录
+def render_images(ctx):
+    records = {record.path: record for record in ctx.images()}
+    tasks = [(record.path, record.has_exif) for record in records.values()]
+    for (image_path, _), result in CreateThumbnails.map_bounded(render_image, tasks):
+        record = records[image_path]
+        ctx.report_items(1, record.size_in_bytes)
+        if isinstance(result, Exception):
+            logging.info(f"Error processing {image_path}: {result}")
+            record.error = str(result)
+            record.transient = is_transient_error(result)
+            continue
+        record.exif = result["exif"]
+        record.renditions = result["renditions"]
+        record.compressed_path = result["compressed_path"]
+        record.compressed_hash = result["compressed_hash"]
+        record.compressed_size_mb = result["compressed_size_mb"]
+        logging.info(f"压缩图像从 {image_path} 到 {record.compressed_path}")
+
+
+# 批量写入 image_exif_index 表
+def index_exif(ctx):
+    with GetImgInfo.exif_writer(ctx.conn, record_write_error) as writer:
+        for record in ctx.images():
+            if record.exif is not None:
+                writer.add((record.key,) + tuple(record.exif), record)
+
+
+# 批量写入 image_compression_index 表、trash 表和 image_rendition 表
+def index_thumbnails(ctx):
+    rendered = [record for record in ctx.images() if record.compressed_path is not None]
+    GetThumbnailsPath.write_compressed_images(ctx.conn, [
+        (
+            record.hash,
+            GetThumbnailsPath.get_relative_compressed_path(record.compressed_path),
+            record.compressed_hash,
+            record.compressed_size_mb,
+        )
+        for record in rendered
+    ], sources=rendered, on_error=record_write_error)
+    with GetThumbnailsPath.rendition_writer(ctx.conn, record_write_error) as writer:
+        for record in rendered:
+            if record.error is not None:
+                continue
+            for name, path, width, height, size_mb in record.renditions:
+                writer.add((
+                    record.key,
+                    name,
+                    GetThumbnailsPath.get_relative_compressed_path(path),
+                    width,
+                    height,
+                    size_mb,
+                ), record)
+
+
+# 批次准备阶段：扫描、去重、登记原图索引并移动文件，每个批次在一个 worker 上执行一次
+# 各阶段写入的表由 schema_migrations 在启动时创建
+PREPARE_STAGES = [
+    ("scan", scan_files),
+    ("move", move_files),
+    ("rm_temp", remove_temp),
+]
+
+# 图片处理阶段：只依赖各自的记录，可以按分块分发到多个 worker 上执行；写入均为 upsert，可安全重试
+IMAGE_STAGES = [
+    ("render", render_images),
+    ("exif_index", index_exif),
+    ("compression_index", index_thumbnails),
+]
+
+# 流水线各阶段，按顺序执行，替代原先逐个启动的脚本；
+# 索引由 schema_migrations 在启动时创建，所有图片处理完成后不再需要访问数据库的收尾阶段
+STAGES = PREPARE_STAGES + IMAGE_STAGES
+
+
+# 使用一个数据库连接依次执行各阶段，并记录每个阶段的用时
+def run_stages(ctx, stages):
+    ctx.conn = get_connection()
+    try:
+        for name, stage in stages:
+            logging.info(f"Running {name}...")
+            if ctx.reporter is not None:
+                ctx.reporter.stage_started(name, len(ctx.records), sum(r.size_in_bytes for r in ctx.records))
+            start = time.perf_counter()
+            try:
+                stage(ctx)
+            except Exception as e:
+                logging.info(f"执行阶段出错 {name}: {e}")
+                raise
+            elapsed = time.perf_counter() - start
+            if ctx.reporter is not None:
+                ctx.reporter.stage_finished(name, elapsed)
+            logging.info(f"阶段 {name} 完成，用时 {elapsed:.2f}s")
+    finally:
+        ctx.conn.close()  # 归还连接池
+        ctx.conn = None
+    return ctx
+
+
+# 执行阶段并记录哈希缓存命中率
+def _run_hashing_stages(ctx, stages):
+    hash_cache.reset_stats()
+    try:
+        return run_stages(ctx, stages)
+    finally:
+        stats = hash_cache.get_stats()
+        logging.info(f"哈希缓存命中 {stats['hits']} 次，未命中 {stats['misses']} 次，命中率 {stats['hit_rate']:.1%}")
+
+
+def run_pipeline(batch_id, images_dir='images', reporter=None):
+    """
+    在当前进程内执行一个上传批次的完整入库流水线。
+
+    各批次使用独立的暂存目录和上下文，多个 worker 可以同时处理不同批次。
+
+    参数:
+        batch_id (str): 上传批次 ID，暂存目录为 temp/<批次ID>。
+        images_dir (str): 原图保存目录。
+        reporter (ProgressReporter): 进度记录，可为 None。
+
+    返回:
+        PipelineContext: 本批次的上下文，包含每个文件的记录。
+    """
+    ctx = PipelineContext(batch_id, images_dir)
+    ctx.reporter = reporter
+    return _run_hashing_stages(ctx, STAGES)
+
+
+def prepare_batch(batch_id, images_dir='images', reporter=None):
+    """
+    执行批次的准备阶段，之后可以用 ImageRecord.to_task() 将图片分块分发给 process_images。
+
+    参数:
+        batch_id (str): 上传批次 ID。
+        images_dir (str): 原图保存目录。
+        reporter (ProgressReporter): 进度记录，可为 None。
+
+    返回:
+        PipelineContext: 本批次的上下文，ctx.images() 为需要继续处理的图片。
+    """
+    ctx = PipelineContext(batch_id, images_dir)
+    ctx.reporter = reporter
+    return _run_hashing_stages(ctx, PREPARE_STAGES)
+
+
+def process_images(batch_id, items, reporter=None):
+    """
+    对一部分图片执行处理阶段：生成多尺寸版本，写入 EXIF、压缩图和多尺寸版本记录。
+
+    参数:
+        batch_id (str): 上传批次 ID。
+        items (list): ImageRecord.to_task() 返回的图片数据。
+        reporter (ProgressReporter): 进度记录，可为 None；多个分块共用一个阶段时使用 shared=True。
+
+    返回:
+        PipelineContext: 上下文，处理失败的图片记录的 error 不为空。
+    """
+    ctx = PipelineContext(batch_id)
+    ctx.reporter = reporter
+    ctx.records = [ImageRecord.from_task(item) for item in items]
+    return run_stages(ctx, IMAGE_STAGES)
+
+
+def release_images(items):
+    """
+    放弃处理的图片：删除尚未生成压缩图记录的 image_index 行，重新上传时不会被当作重复文件而丢弃。
+
+    被释放的原图从 images 目录移到 QUARANTINE_FOLDER，已生成的各尺寸版本一并删除，
+    不在 images 和 compressed 中留下没有索引的文件。已有压缩图记录的图片不受影响。
+
+    参数:
+        items (list): ImageRecord.to_task() 返回的图片数据。
+    """
+    if not items:
+        return
+    keys = [to_key(item["hash"]) for item in items]
+    placeholders = ', '.join(['%s'] * len(keys))
+    conn = get_connection()
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT i.id FROM image_index i
+            LEFT JOIN image_compression_index ic ON ic.id = i.id
+            WHERE i.id IN ({placeholders}) AND ic.id IS NULL
+            FOR UPDATE
+        ''', keys)
+        released = {from_db(row[0]) for row in cursor.fetchall()}
+        for table in ("image_exif_index", "image_index"):
+            cursor.execute(f'''
+                DELETE t FROM {table} t
+                LEFT JOIN image_compression_index ic ON ic.id = t.id
+                WHERE t.id IN ({placeholders}) AND ic.id IS NULL
+            ''', keys)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logging.info(f"释放处理失败的图片出错: {e}")
+        return
+    finally:
+        if cursor is not None:
+            cursor.close()
+        conn.close()  # 归还连接池
+    for item, key in zip(items, keys):
+        if key not in released:
+            continue
+        if item["path"] is not None:
+            quarantine_image(item)
+        logging.info(f"已释放处理失败的图片 {item['path'] or item['hash']}，可重新上传")
+
+
+# 将放弃处理的原图移到隔离目录（文件名前加哈希值避免重名），并删除已生成的各尺寸版本
+def quarantine_image(item):
+    image_path = item["path"]
+    remove_files([CreateThumbnails.get_rendition_path(image_path, name) for name in RENDITION_SIZES])
+    dst = os.path.join(QUARANTINE_FOLDER, f"{item['hash'][:16]}_{os.path.basename(image_path)}")
+    try:
+        os.makedirs(QUARANTINE_FOLDER, exist_ok=True)
+        shutil.move(image_path, dst)
+        logging.info(f"原图已移到隔离目录: {image_path} 到 {dst}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.info(f"移动原图到隔离目录失败 {image_path}: {e}")
@@ -0,0 +1,77 @@
+import functools
+import hashlib
+import logging
+
+import redis
+from flask import request, make_response
+
+from config import RESPONSE_CACHE_REDIS_URL, RESPONSE_CACHE_TTL
+
+# 缓存代数：图片列表发生变化时加一，旧代数下的缓存不再被读取，随 TTL 过期
+GENERATION_KEY = 'listing_cache:generation'
+
+_redis = None
+
+
+# 获取 Redis 连接（与 Celery 共用同一个 Redis）
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(RESPONSE_CACHE_REDIS_URL, socket_connect_timeout=2)
+    return _redis
+
+
+# 图片列表发生变化（上传、标签、删除、恢复、彻底删除）后调用，使所有列表缓存失效
+def bump_generation():
+    try:
+        return _get_redis().incr(GENERATION_KEY)
+    except redis.RedisError as e:
+        logging.info(f"更新列表缓存代数失败: {e}")
+        return None
+
+
+def _cache_key(generation):
+    return f"listing_cache:{generation}:{hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()}"
+
+
+def cached_listing(view):
+    """
+    列表接口的响应缓存装饰器。
+
+    响应体按 (缓存代数, 请求路径和参数) 缓存在 Redis 中，并以响应体的哈希作为 ETag；
+    请求带 If-None-Match 且内容未变化时返回 304。Redis 不可用时直接执行原接口。
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            client = _get_redis()
+            # 先读代数再查询数据库，查询期间发生的变化会使这次结果写入已经失效的代数
+            key = _cache_key(int(client.get(GENERATION_KEY) or 0))
+            cached = client.get(key)
+        except redis.RedisError as e:
+            logging.info(f"读取列表缓存失败: {e}")
+            return view(*args, **kwargs)
+
+        if cached is not None:
+            etag, body = cached.split(b'\n', 1)
+            response = make_response(body)
+            response.mimetype = 'application/json'
+            etag = etag.decode('ascii')
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            try:
+                client.setex(key, RESPONSE_CACHE_TTL, etag.encode('ascii') + b'\n' + body)
+            except redis.RedisError as e:
+                logging.info(f"写入列表缓存失败: {e}")
+
+        # 浏览器每次都带 ETag 重新验证，内容未变时只返回 304
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+    return wrapper
@@ -13,8 +13,9 @@ def delete_temp_folder(temp_folder_path):
     else:
         logging.info(f"文件夹 {temp_folder_path} 不存在。")
 
-# 指定 temp 文件夹路径
-temp_directory_path = 'temp'
+if __name__ == '__main__':
+    # 指定 temp 文件夹路径
+    temp_directory_path = 'temp'
 
-# 调用删除函数
-delete_temp_folder(temp_directory_path)
+    # 调用删除函数
+    delete_temp_folder(temp_directory_path)
@@ -0,0 +1,247 @@
+import logging
+
+import mysql.connector
+
+from config import db_config
+import GetImgInfo
+import GetPath
+import GetThumbnailsPath
+import tag_index
+
+# 多个进程（Web、各 worker）同时启动时，只有一个进程执行迁移
+MIGRATION_LOCK = 'qpm_schema_migration'
+MIGRATION_LOCK_TIMEOUT = 300  # 等待其他进程完成迁移的最长时间（秒）
+
+
+# 查询索引是否存在
+def index_exists(cursor, table, index):
+    cursor.execute('''
+        SELECT COUNT(1) FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND INDEX_NAME = %s
+    ''', (db_config['database'], table, index))
+    return cursor.fetchone()[0] > 0
+
+
+# 查询列是否存在
+def column_exists(cursor, table, column):
+    cursor.execute('''
+        SELECT COUNT(1) FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    ''', (db_config['database'], table, column))
+    return cursor.fetchone()[0] > 0
+
+
+# 创建索引（如果不存在）
+def add_index(cursor, table, index, columns):
+    if not index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+        logging.info(f"索引 '{index}' 已创建！")
+
+
+# 1. 入库使用的各张表，原先在每次入库时创建
+def create_base_tables(cursor):
+    GetPath.create_image_index_table(cursor)
+    GetImgInfo.create_exif_table(cursor)
+    GetThumbnailsPath.create_compression_tables(cursor)
+    GetThumbnailsPath.create_rendition_table(cursor)
+    create_legacy_image_tag_table(cursor)
+
+
+# 旧的 imageTag 表（JSON 标签），第 3 步从中迁移标签，第 6 步删除；新数据库也依次执行这些步骤
+def create_legacy_image_tag_table(cursor):
+    cursor.execute('''
+       CREATE TABLE IF NOT EXISTS imageTag (
+            compressed_path VARCHAR(255) NOT NULL,
+            compressed_hash BINARY(32) NOT NULL,
+            tags JSON DEFAULT NULL,  -- 将tags字段类型设为JSON
+            PRIMARY KEY (compressed_hash)
+        )
+    ''')
+
+
+# 2. trash 表的移入回收站时间；已在回收站中的图片从迁移时开始计算保留天数
+def add_trashed_at(cursor):
+    if not column_exists(cursor, 'trash', 'trashed_at'):
+        cursor.execute("ALTER TABLE trash ADD COLUMN trashed_at DATETIME DEFAULT NULL")
+        cursor.execute("UPDATE trash SET trashed_at = NOW() WHERE type = 1 AND trashed_at IS NULL")
+    add_index(cursor, 'trash', 'idx_trash_type_trashed_at', 'type, trashed_at')
+
+
+# 3. 标签表和文件名全文索引，并迁移旧的 JSON 标签
+def create_tag_schema(cursor):
+    # image_tag.image_id 为 BINARY(32)，尚未执行本步的旧数据库需先转换哈希值列（见第 5 步），外键两端的类型才能一致；
+    # 已执行过本步的数据库不受影响，由第 5 步转换
+    convert_hash_columns(cursor)
+    tag_index.create_tag_tables(cursor)
+    tag_index.create_filename_index(cursor)
+    tag_index.backfill_tags(cursor)
+
+
+# 4. 列表、查询和删除使用的二级索引
+def add_secondary_indexes(cursor):
+    # 主页和回收站按 type 过滤，再按 (compressed_path, id) 倒序分页
+    add_index(cursor, 'trash', 'idx_trash_type_path', 'type, compressed_path, id')
+    # 删除、恢复按 compressed_path 更新 trash
+    add_index(cursor, 'trash', 'idx_compressed_path', 'compressed_path')
+    # 添加标签、查询原图、多尺寸版本和批量操作按 compressed_path 查找图片
+    add_index(cursor, 'image_compression_index', 'idx_ic_compressed_path', 'compressed_path')
+    # 彻底删除时按 compressed_path 删除 imageTag
+    add_index(cursor, 'imageTag', 'idx_imagetag_compressed_path', 'compressed_path')
+
+
+# 以 SHA-256 十六进制字符串存储的列：(表名, 列名, 是否可为空)
+HASH_COLUMNS = [
+    ('image_index', 'id', False),
+    ('image_exif_index', 'id', False),
+    ('image_compression_index', 'id', False),
+    ('image_compression_index', 'compressed_hash', True),
+    ('trash', 'id', False),
+    ('image_rendition', 'id', False),
+    ('imageTag', 'compressed_hash', False),  # 第 6 步删除该表之后不再转换
+    ('image_tag', 'image_id', False),
+    ('face_detection_index', 'id', False),
+]
+
+# 引用 image_compression_index.id 的外键，转换列类型前删除，转换后重建
+HASH_FOREIGN_KEYS = [
+    ('trash', 'id'),
+    ('image_tag', 'image_id'),
+]
+
+
+# 查询列的数据类型，表或列不存在时返回 None
+def column_type(cursor, table, column):
+    cursor.execute('''
+        SELECT DATA_TYPE FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    ''', (db_config['database'], table, column))
+    row = cursor.fetchone()
+    return row[0].lower() if row else None
+
+
+# 查询列上引用 image_compression_index 的外键名
+def hash_foreign_keys(cursor, table, column):
+    cursor.execute('''
+        SELECT CONSTRAINT_NAME FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s AND COLUMN_NAME = %s
+          AND REFERENCED_TABLE_NAME = 'image_compression_index'
+    ''', (db_config['database'], table, column))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# 5. 哈希值列由 CHAR(64) 十六进制改为 BINARY(32)，主键和二级索引的大小减半，比较按字节进行
+# DDL 会隐式提交，中途失败后再次执行时从中断处继续：VARBINARY 列为上次改到一半的列，只转换仍为十六进制的值
+def convert_hash_columns(cursor):
+    pending = []
+    for table, column, nullable in HASH_COLUMNS:
+        data_type = column_type(cursor, table, column)
+        if data_type in ('char', 'varbinary'):
+            pending.append((table, column, nullable, data_type))
+    foreign_keys = [(table, column) for table, column in HASH_FOREIGN_KEYS if column_type(cursor, table, column)]
+
+    if pending:
+        # 外键两端的类型必须一致，先删除引用 image_compression_index 的外键
+        for table, column in foreign_keys:
+            for constraint in hash_foreign_keys(cursor, table, column):
+                cursor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {constraint}")
+
+    # 先改为 VARBINARY(64) 保留原有字节，再原地 UNHEX，最后收紧为 BINARY(32)；主键和索引随列保留
+    for table, column, nullable, data_type in pending:
+        null = "NULL" if nullable else "NOT NULL"
+        if data_type == 'char':
+            cursor.execute(f"ALTER TABLE {table} MODIFY {column} VARBINARY(64) {null}")
+        cursor.execute(f"UPDATE {table} SET {column} = UNHEX({column}) WHERE LENGTH({column}) = 64")
+        cursor.execute(f"ALTER TABLE {table} MODIFY {column} BINARY(32) {null}")
+        logging.info(f"{table}.{column} 已转换为 BINARY(32)")
+
+    # 每次执行都补齐缺少的外键，上次在删除外键之后中断时也能恢复
+    for table, column in foreign_keys:
+        if not hash_foreign_keys(cursor, table, column):
+            cursor.execute(f'''
+                ALTER TABLE {table} ADD FOREIGN KEY ({column})
+                REFERENCES image_compression_index(id) ON DELETE CASCADE
+            ''')
+
+
+# 6. 删除旧的 imageTag 表：标签已由第 3 步迁移到 tag/image_tag 表，入库和彻底删除不再读写 imageTag；
+# 删除前再合并一次 JSON 标签，第 3 步之后写入 imageTag 的标签也不会丢失
+def drop_image_tag_table(cursor):
+    if column_type(cursor, 'imageTag', 'tags') is None:
+        return
+    tag_index.copy_legacy_tags(cursor)
+    cursor.execute("DROP TABLE imageTag")
+    logging.info("旧的 imageTag 表已删除")
+
+
+# 按版本号顺序执行，已执行的版本记录在 schema_version 表中；只能在末尾追加新版本，
+# 修改已有版本时不能改变它对已执行过该版本的数据库的效果（例如第 1 步的建表语句只作用于新数据库）
+MIGRATIONS = [
+    (1, 'create_base_tables', create_base_tables),
+    (2, 'add_trashed_at', add_trashed_at),
+    (3, 'create_tag_schema', create_tag_schema),
+    (4, 'add_secondary_indexes', add_secondary_indexes),
+    (5, 'convert_hash_columns', convert_hash_columns),
+    (6, 'drop_image_tag_table', drop_image_tag_table),
+]
+
+
+def migrate(conn):
+    """
+    执行尚未执行的迁移，每个版本执行完后单独提交并记录。
+
+    各版本的语句都会先检查表、列和索引是否存在，对已有的数据库可以安全执行。
+
+    参数:
+        conn: MySQL 连接。
+
+    返回:
+        list: 本次执行的版本号。
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT GET_LOCK(%s, %s)", (MIGRATION_LOCK, MIGRATION_LOCK_TIMEOUT))
+        if cursor.fetchone()[0] != 1:
+            raise RuntimeError("Timed out waiting for schema migration lock")
+        try:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT NOT NULL,
+                    name VARCHAR(100) NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (version)
+                )
+            ''')
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            current = cursor.fetchone()[0]
+            applied = []
+            for version, name, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                logging.info(f"执行数据库迁移 {version}: {name}")
+                apply(cursor)
+                cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.append(version)
+            if applied:
+                logging.info(f"数据库已迁移到版本 {applied[-1]}")
+            return applied
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (MIGRATION_LOCK,))
+            cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+# 启动时调用：使用单独的连接执行迁移，不占用连接池
+def run_migrations():
+    conn = mysql.connector.connect(**db_config)
+    try:
+        return migrate(conn)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from config import configure_logging
+    configure_logging()
+    run_migrations()
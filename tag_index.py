@@ -0,0 +1,221 @@
+import json
+import logging
+
+from config import db_config, TAG_MAX_LENGTH, FILENAME_NGRAM_SIZE
+from image_keys import from_db
+
+
+def create_tag_tables(cursor):
+    """
+    创建标签字典表 tag 和图片-标签关联表 image_tag（如果不存在）。
+
+    image_tag 以 (tag_id, image_id) 为主键，按标签查图片走主键；另建 image_id 索引，按图片查标签。
+    图片从 image_compression_index 删除时，关联记录随外键一起删除。
+
+    参数:
+        cursor: MySQL 游标。
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS tag (
+            tag_id INT NOT NULL AUTO_INCREMENT,
+            name VARCHAR({TAG_MAX_LENGTH}) NOT NULL,
+            PRIMARY KEY (tag_id),
+            UNIQUE KEY uk_tag_name (name)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_tag (
+            tag_id INT NOT NULL,
+            image_id BINARY(32) NOT NULL,
+            added_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (tag_id, image_id),
+            KEY idx_image_tag_image (image_id),
+            FOREIGN KEY (tag_id) REFERENCES tag(tag_id),
+            FOREIGN KEY (image_id) REFERENCES image_compression_index(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+# 为文件名搜索创建 ngram 全文索引（如果不存在）
+def create_filename_index(cursor):
+    cursor.execute('''
+        SELECT COUNT(1)
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = %s
+          AND TABLE_NAME = 'image_compression_index'
+          AND INDEX_NAME = 'ft_compressed_path'
+    ''', (db_config['database'],))
+    if not cursor.fetchone()[0]:
+        cursor.execute('''
+            ALTER TABLE image_compression_index
+            ADD FULLTEXT INDEX ft_compressed_path (compressed_path) WITH PARSER ngram
+        ''')
+        logging.info("全文索引 'ft_compressed_path' 已创建！")
+
+
+# 将 imageTag.tags 中的 JSON 标签迁移到 image_tag 表（tag 表为空时执行一次）
+def backfill_tags(cursor):
+    cursor.execute("SELECT 1 FROM tag LIMIT 1")
+    if cursor.fetchone():
+        return
+    copy_legacy_tags(cursor)
+
+
+# 将 imageTag.tags 中的 JSON 标签合并到 image_tag 表，已有的关联保持不变
+def copy_legacy_tags(cursor):
+    cursor.execute('''
+        SELECT ic.id, it.tags FROM imageTag it
+        JOIN image_compression_index ic ON ic.compressed_path = it.compressed_path
+        WHERE it.tags IS NOT NULL
+    ''')
+    rows = cursor.fetchall()
+    for image_id, tags in rows:
+        add_tags(cursor, image_id, json.loads(tags))
+    logging.info(f"已将 {len(rows)} 张图片的标签迁移到 image_tag 表。")
+
+
+# 规范化标签名，去掉首尾空白后为空或过长时返回 None
+def normalize_tag(name):
+    name = str(name).strip()
+    if not name or len(name) > TAG_MAX_LENGTH:
+        return None
+    return name
+
+
+def add_tags(cursor, image_id, names):
+    """
+    为图片添加标签，标签字典中没有的标签自动创建，已有的关联保持不变。
+
+    参数:
+        cursor: MySQL 游标。
+        image_id (bytes): 图片主键（BINARY(32) 哈希值）。
+        names (list): 标签名列表。
+
+    返回:
+        int: 新增的关联数。
+    """
+    names = list(dict.fromkeys(n for n in (normalize_tag(name) for name in names) if n))
+    if not names:
+        return 0
+    placeholders = ', '.join(['%s'] * len(names))
+    cursor.execute(f"INSERT IGNORE INTO tag (name) VALUES {', '.join(['(%s)'] * len(names))}", names)
+    cursor.execute(f'''
+        INSERT IGNORE INTO image_tag (tag_id, image_id)
+        SELECT tag_id, %s FROM tag WHERE name IN ({placeholders})
+    ''', [image_id] + names)
+    return cursor.rowcount
+
+
+def add_tags_to_images(cursor, image_ids, names):
+    """
+    为多张图片添加同一组标签，每张表只执行一条语句。
+
+    参数:
+        cursor: MySQL 游标。
+        image_ids (list): 图片主键列表（需已存在于 image_compression_index）。
+        names (list): 标签名列表。
+
+    返回:
+        dict: {标签名: 新增关联的图片数}，标签名使用数据库中已有的写法。
+    """
+    image_ids = list(dict.fromkeys(image_ids))
+    names = list({n.casefold(): n for n in (normalize_tag(name) for name in names) if n}.values())
+    if not image_ids or not names:
+        return {}
+    name_placeholders = ', '.join(['%s'] * len(names))
+    id_placeholders = ', '.join(['%s'] * len(image_ids))
+    cursor.execute(f"INSERT IGNORE INTO tag (name) VALUES {', '.join(['(%s)'] * len(names))}", names)
+    # 先统计已有的关联，插入后按差值得到每个标签新增的数量
+    cursor.execute(f'''
+        SELECT t.name, COUNT(it.image_id) FROM tag t
+        LEFT JOIN image_tag it ON it.tag_id = t.tag_id AND it.image_id IN ({id_placeholders})
+        WHERE t.name IN ({name_placeholders})
+        GROUP BY t.tag_id, t.name
+    ''', image_ids + names)
+    existing = cursor.fetchall()
+    cursor.execute(f'''
+        INSERT IGNORE INTO image_tag (tag_id, image_id)
+        SELECT t.tag_id, ic.id FROM tag t
+        JOIN image_compression_index ic ON ic.id IN ({id_placeholders})
+        WHERE t.name IN ({name_placeholders})
+    ''', image_ids + names)
+    return {name: len(image_ids) - count for name, count in existing if count < len(image_ids)}
+
+
+# 批量查询多张图片的标签，返回 {图片主键: [标签, ...]}，标签按添加顺序排列
+def get_tags_for_images(cursor, image_ids):
+    tags = {image_id: [] for image_id in image_ids}
+    if not tags:
+        return tags
+    placeholders = ', '.join(['%s'] * len(tags))
+    cursor.execute(f'''
+        SELECT it.image_id, t.name FROM image_tag it
+        JOIN tag t ON t.tag_id = it.tag_id
+        WHERE it.image_id IN ({placeholders})
+        ORDER BY it.added_at, it.tag_id
+    ''', list(tags))
+    for image_id, name in cursor.fetchall():
+        tags[from_db(image_id)].append(name)
+    return tags
+
+
+# 转义 LIKE 中的通配符，用于前缀匹配
+def like_prefix(text):
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def text_search_query(text):
+    """
+    生成关键词搜索的子查询：标签前缀匹配（走 tag.name 索引）或文件名匹配（走 ngram 全文索引）。
+
+    关键词短于 ngram 长度时无法使用全文索引，只匹配标签。
+
+    参数:
+        text (str): 搜索关键词。
+
+    返回:
+        tuple: (子查询 SQL, 参数列表)，子查询返回 compressed_path 和 id 两列。
+    """
+    query = '''
+        SELECT ic.compressed_path, ic.id FROM tag t
+        JOIN image_tag it ON it.tag_id = t.tag_id
+        JOIN image_compression_index ic ON ic.id = it.image_id
+        WHERE t.name LIKE %s
+    '''
+    params = [like_prefix(text)]
+    # 按短语匹配，去掉会改变布尔模式语义的双引号
+    phrase = text.replace('"', ' ').strip()
+    if len(phrase) >= FILENAME_NGRAM_SIZE:
+        query += '''
+        UNION
+        SELECT ic.compressed_path, ic.id FROM image_compression_index ic
+        WHERE MATCH(ic.compressed_path) AGAINST (%s IN BOOLEAN MODE)
+        '''
+        params.append(f'"{phrase}"')
+    return query, params
+
+
+def tags_search_query(names, match_all):
+    """
+    生成多标签搜索的子查询。
+
+    参数:
+        names (list): 标签名列表（精确匹配）。
+        match_all (bool): True 时图片需包含全部标签（AND），否则包含任一标签（OR）。
+
+    返回:
+        tuple: (子查询 SQL, 参数列表)，子查询返回 compressed_path 和 id 两列。
+    """
+    placeholders = ', '.join(['%s'] * len(names))
+    query = f'''
+        SELECT ic.compressed_path, ic.id FROM tag t
+        JOIN image_tag it ON it.tag_id = t.tag_id
+        JOIN image_compression_index ic ON ic.id = it.image_id
+        WHERE t.name IN ({placeholders})
+        GROUP BY ic.id, ic.compressed_path
+    '''
+    params = list(names)
+    if match_all:
+        query += ' HAVING COUNT(*) = %s'
+        params.append(len(names))
+    return query, params
@@ -0,0 +1,170 @@
+import bisect
+import heapq
+import json
+import logging
+import threading
+import time
+
+import redis
+
+from config import TAG_SUGGEST_REDIS_URL
+
+# 每个前缀缓存的候选数量，limit 不超过它时直接从缓存返回
+SUGGEST_CACHE_SIZE = 100
+
+# worker 发布标签使用次数变化的 Redis 频道，消息为 {标签名: 变化量} 的 JSON
+TAG_DELTA_CHANNEL = 'tag_suggest:deltas'
+RECONNECT_DELAY = 5  # 与 Redis 的连接断开后重新订阅的间隔（秒）
+
+_redis = None
+
+
+# 获取 Redis 连接（与 Celery 共用同一个 Redis）；订阅时一直阻塞等待消息，不设置读取超时
+def _get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(TAG_SUGGEST_REDIS_URL, socket_connect_timeout=2)
+    return _redis
+
+
+def publish_tag_deltas(deltas):
+    """
+    发布标签使用次数的变化，Web 进程的自动补全索引收到后增量更新。
+
+    worker 中彻底删除图片时调用；Web 进程内的变化直接更新自己的索引，不需要发布。
+
+    参数:
+        deltas (dict): {标签名: 使用次数的变化量}。
+    """
+    if not deltas:
+        return
+    try:
+        _get_redis().publish(TAG_DELTA_CHANNEL, json.dumps(deltas))
+    except redis.RedisError as e:
+        logging.info(f"发布标签使用次数变化失败: {e}")
+
+
+class TagSuggestIndex:
+    """
+    标签自动补全的内存索引：按小写标签名排序的列表加使用次数。
+
+    前缀查询用二分查找定位，只扫描匹配前缀的标签，不访问数据库；
+    每个前缀的结果会缓存，标签的使用次数变化时只清除该标签各个前缀的缓存。
+    标签名不区分大小写，与数据库中 tag.name 的唯一索引一致。
+    """
+
+    def __init__(self):
+        self._keys = []  # 排序后的小写标签名
+        self._names = {}  # {小写标签名: 标签名}
+        self._counts = {}  # {小写标签名: 使用该标签的图片数}
+        self._cache = {}  # {小写前缀: [(使用次数, 标签名), ...]}
+        self._lock = threading.Lock()
+
+    def load(self, cursor):
+        """
+        从数据库加载全部标签及使用次数，替换当前内容。
+
+        参数:
+            cursor: MySQL 游标。
+        """
+        start = time.perf_counter()
+        cursor.execute('''
+            SELECT t.name, COUNT(it.image_id) FROM tag t
+            LEFT JOIN image_tag it ON it.tag_id = t.tag_id
+            GROUP BY t.tag_id, t.name
+        ''')
+        names, counts = {}, {}
+        for name, count in cursor.fetchall():
+            names[name.casefold()] = name
+            counts[name.casefold()] = count
+        with self._lock:
+            self._keys, self._names, self._counts, self._cache = sorted(names), names, counts, {}
+        logging.info(f"已加载 {len(counts)} 个标签到自动补全索引，用时 {time.perf_counter() - start:.3f}s")
+
+    # 调整标签的使用次数，新标签加入索引
+    def add(self, name, delta=1):
+        key = name.casefold()
+        with self._lock:
+            if key not in self._counts:
+                bisect.insort(self._keys, key)
+                self._names[key] = name
+                self._counts[key] = 0
+            self._counts[key] = max(self._counts[key] + delta, 0)
+            for i in range(1, len(key) + 1):
+                self._cache.pop(key[:i], None)
+
+    # 按 {标签名: 变化量} 批量调整使用次数
+    def apply_deltas(self, deltas):
+        for name, delta in deltas.items():
+            self.add(name, delta)
+
+    def listen(self, get_connection):
+        """
+        订阅 worker 发布的标签使用次数变化并更新索引，在 Web 进程的后台任务中一直运行。
+
+        与 Redis 的连接断开后重新订阅，并从数据库重新加载，补上断开期间错过的变化。
+
+        参数:
+            get_connection: 返回 MySQL 连接的函数，重新加载时使用。
+        """
+        reconnecting = False
+        while True:
+            try:
+                pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(TAG_DELTA_CHANNEL)
+                if reconnecting:
+                    self._reload(get_connection)
+                    reconnecting = False
+                for message in pubsub.listen():
+                    try:
+                        self.apply_deltas(json.loads(message["data"]))
+                    except (ValueError, AttributeError) as e:
+                        logging.info(f"忽略无法解析的标签使用次数变化: {e}")
+            except redis.RedisError as e:
+                logging.info(f"订阅标签使用次数变化失败，{RECONNECT_DELAY} 秒后重试: {e}")
+                reconnecting = True
+                time.sleep(RECONNECT_DELAY)
+
+    # 使用新的数据库连接重新加载全部标签
+    def _reload(self, get_connection):
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                self.load(cursor)
+            finally:
+                cursor.close()
+        except Exception as e:
+            logging.info(f"重新加载标签自动补全索引失败: {e}")
+        finally:
+            conn.close()
+
+    def suggest(self, prefix, limit=10):
+        """
+        查询以 prefix 开头（不区分大小写）的标签，按使用次数从多到少排列；已没有图片使用的标签不返回。
+
+        参数:
+            prefix (str): 标签前缀。
+            limit (int): 最多返回的数量。
+
+        返回:
+            list: 每个元素是 {"tag": 标签名, "count": 使用次数}。
+        """
+        key = prefix.casefold()
+        with self._lock:
+            matches = self._cache.get(key) if limit <= SUGGEST_CACHE_SIZE else None
+            if matches is None:
+                matches = heapq.nsmallest(
+                    max(limit, SUGGEST_CACHE_SIZE),
+                    ((-self._counts[k], self._names[k]) for k in self._matching_keys(key) if self._counts[k] > 0),
+                )
+                matches = [(-count, name) for count, name in matches]
+                self._cache[key] = matches[:SUGGEST_CACHE_SIZE]
+        return [{"tag": name, "count": count} for count, name in matches[:limit]]
+
+    # 依次返回以 key 开头的小写标签名
+    def _matching_keys(self, key):
+        i = bisect.bisect_left(self._keys, key)
+        while i < len(self._keys) and self._keys[i].startswith(key):
+            yield self._keys[i]
+            i += 1
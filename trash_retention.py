@@ -0,0 +1,56 @@
+import time
+
+from config import TRASH_PURGE_BATCH_SIZE, TRASH_PURGE_ROWS_PER_SECOND, TRASH_PURGE_BYTES_PER_SECOND
+from bulk_ops import purge_trash
+from db_pool import get_connection
+
+
+class RateLimiter:
+    """
+    按累计处理量限速：处理得比设定速率快时等待，使平均速率不超过每秒 rows_per_second 行、bytes_per_second 字节。
+    """
+
+    def __init__(self, rows_per_second, bytes_per_second):
+        self.rows_per_second = rows_per_second
+        self.bytes_per_second = bytes_per_second
+        self.start = time.monotonic()
+
+    # 根据开始以来的累计行数和字节数等待
+    def wait(self, rows, nbytes):
+        required = max(rows / self.rows_per_second, nbytes / self.bytes_per_second)
+        delay = required - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def purge_expired_images(retention_days, on_batch=None):
+    """
+    彻底删除移入回收站超过 retention_days 天的图片，按 TRASH_PURGE_ROWS_PER_SECOND
+    和 TRASH_PURGE_BYTES_PER_SECOND 限速。
+
+    参数:
+        retention_days (int): 保留天数。
+        on_batch (callable): 每批提交后调用 on_batch(累计删除数, 累计删除的文件字节数, {标签名: 减少的使用次数})。
+
+    返回:
+        int: 删除的图片数。
+    """
+    # trashed_at 由数据库的 NOW() 写入，截止时间也按数据库时钟计算
+    conn = get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT NOW() - INTERVAL %s DAY", (retention_days,))
+        trashed_before = cursor.fetchone()[0]
+        cursor.close()
+    finally:
+        conn.close()  # 归还连接池
+    limiter = RateLimiter(TRASH_PURGE_ROWS_PER_SECOND, TRASH_PURGE_BYTES_PER_SECOND)
+
+    def throttled(destroyed, freed_bytes, removed_tags):
+        if on_batch is not None:
+            on_batch(destroyed, freed_bytes, removed_tags)
+        limiter.wait(destroyed, freed_bytes)
+
+    # 每批不超过一秒的配额，限速等待均匀分布在各批之间
+    batch_size = max(1, min(TRASH_PURGE_BATCH_SIZE, TRASH_PURGE_ROWS_PER_SECOND))
+    return purge_trash(batch_size, on_batch=throttled, trashed_before=trashed_before)
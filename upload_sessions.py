@@ -0,0 +1,186 @@
+import hashlib
+import json
+import logging
+import os
+
+import upload_storage
+from config import UPLOAD_CHUNK_SIZE
+from hash_cache import compute_sha256
+
+# 上传会话信息文件，保存在批次暂存目录中（以点开头，流水线不会当作上传内容）
+SESSION_FILE = '.session.json'
+
+# 按顺序接收的文件边写边算哈希：{未写完的文件路径: (SHA-256 对象, 已计算的字节数)}
+# 只保存在当前进程中；数据不是从已计算的位置续传（重发、换进程、重启）时，完成后重新读取文件计算
+_hashers = {}
+MAX_HASHERS = 1000  # 最多同时保存的哈希状态数，超出时丢弃最早的（放弃的上传不会一直占用内存）
+
+
+class UploadConflict(Exception):
+    """写入的起始位置与服务器已接收的字节数不一致。"""
+
+    def __init__(self, offset):
+        super().__init__(f"Expected offset {offset}")
+        self.offset = offset
+
+
+# 单个文件未写完的数据和完成标记的路径
+def _part_path(staging_dir, file_id):
+    return os.path.join(staging_dir, f".{file_id}.part")
+
+
+def _done_path(staging_dir, file_id):
+    return os.path.join(staging_dir, f".{file_id}.done")
+
+
+def create_session(files):
+    """
+    创建分块上传会话，会话 ID 即批次 ID。
+
+    参数:
+        files (list): 每个元素是 {"name": 文件名, "size": 字节数}。
+
+    返回:
+        tuple: (会话 ID, 文件列表)；文件列表中每个元素包含 file_id、index（在请求列表中的位置）、name、size，
+               隐藏文件、非图片文件和空文件不会出现在列表中。
+    """
+    upload_id = upload_storage.new_batch_id()
+    staging_dir = upload_storage.get_staging_dir(upload_id)
+    os.makedirs(staging_dir, exist_ok=True)
+
+    entries = []
+    for index, file in enumerate(files):
+        name = os.path.basename(str(file.get('name', '')))
+        size = int(file.get('size', 0))
+        skip_reason = upload_storage.check_upload_name(name)
+        if skip_reason or size <= 0:
+            logging.info(skip_reason or f"检查到空文件“{name}”，已跳过")
+            continue
+        entries.append({"file_id": str(len(entries)), "index": index, "name": name, "size": size})
+
+    with open(os.path.join(staging_dir, SESSION_FILE), 'w', encoding='utf-8') as f:
+        json.dump({"files": entries}, f, ensure_ascii=False)
+    return upload_id, entries
+
+
+# 读取会话信息，会话不存在时返回 None
+def load_session(upload_id):
+    staging_dir = upload_storage.get_staging_dir(upload_id)
+    session_path = os.path.join(staging_dir, SESSION_FILE)
+    if not os.path.exists(session_path):
+        return None
+    with open(session_path, encoding='utf-8') as f:
+        session = json.load(f)
+    session["staging_dir"] = staging_dir
+    session["files"] = {entry["file_id"]: entry for entry in session["files"]}
+    return session
+
+
+# 获取文件已接收的字节数
+def get_offset(session, entry):
+    if os.path.exists(_done_path(session["staging_dir"], entry["file_id"])):
+        return entry["size"]
+    part_path = _part_path(session["staging_dir"], entry["file_id"])
+    return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+
+# 获取文件的上传状态
+def get_file_status(session, entry):
+    offset = get_offset(session, entry)
+    return {"file_id": entry["file_id"], "offset": offset, "size": entry["size"], "complete": offset == entry["size"]}
+
+
+def write_chunk(session, entry, start, stream):
+    """
+    从 start 位置写入一段数据；重复发送已接收的数据会覆盖相同的字节，可安全重试。
+
+    参数:
+        session (dict): load_session 返回的会话。
+        entry (dict): 会话中的文件。
+        start (int): 本段数据的起始字节位置。
+        stream: 请求体数据流。
+
+    返回:
+        dict: 写入后的文件状态。
+
+    异常:
+        UploadConflict: start 超过了已接收的字节数。
+        ValueError: 数据超过了文件声明的大小。
+    """
+    staging_dir = session["staging_dir"]
+    offset = get_offset(session, entry)
+    if offset == entry["size"]:
+        return get_file_status(session, entry)
+    if start > offset:
+        raise UploadConflict(offset)
+
+    part_path = _part_path(staging_dir, entry["file_id"])
+    hasher = _take_hasher(part_path, start)
+    position = start
+    try:
+        with open(part_path, 'r+b' if os.path.exists(part_path) else 'wb') as f:
+            f.seek(start)
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                if position + len(chunk) > entry["size"]:
+                    raise ValueError("Chunk exceeds declared file size")
+                f.write(chunk)
+                position += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+    finally:
+        # 请求中断时保留已写入部分的哈希，下一段从这里续传时继续计算
+        if hasher is not None and position < entry["size"]:
+            _put_hasher(part_path, hasher, position)
+
+    if os.path.getsize(part_path) == entry["size"]:
+        digest = hasher.hexdigest() if hasher is not None and position == entry["size"] else None
+        _complete_file(staging_dir, entry, part_path, digest)
+    return get_file_status(session, entry)
+
+
+# 取出从 start 位置继续计算的哈希状态；从头写入时新建，位置对不上时返回 None（完成后重新读取文件）
+def _take_hasher(part_path, start):
+    state = _hashers.pop(part_path, None)
+    if start == 0:
+        return hashlib.sha256()
+    if state is not None and state[1] == start:
+        return state[0]
+    return None
+
+
+def _put_hasher(part_path, hasher, position):
+    _hashers[part_path] = (hasher, position)
+    while len(_hashers) > MAX_HASHERS:
+        _hashers.pop(next(iter(_hashers)))
+
+
+# 文件接收完成：按内容哈希保存到暂存目录；没有边写边算的哈希时读取文件计算
+def _complete_file(staging_dir, entry, part_path, digest=None):
+    if digest is None:
+        digest = compute_sha256(part_path)
+    # 先写完成标记，提交期间查询进度也会得到完整的字节数
+    with open(_done_path(staging_dir, entry["file_id"]), 'w') as f:
+        f.write(digest)
+    try:
+        upload_storage.commit_part(part_path, digest, staging_dir, entry["name"])
+    except FileNotFoundError:
+        # 同一文件的另一请求已经完成了提交
+        pass
+
+
+# 结束会话，之后不再接收数据；会话已结束（例如重复提交）时返回 False
+def close_session(session):
+    session_path = os.path.join(session["staging_dir"], SESSION_FILE)
+    try:
+        os.rename(session_path, session_path + '.closed')
+    except FileNotFoundError:
+        return False
+    return True
+
+
+# 获取会话中尚未上传完成的文件
+def get_incomplete_files(session):
+    return [
+        status for status in (get_file_status(session, entry) for entry in session["files"].values())
+        if not status["complete"]
+    ]
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+from config import UPLOAD_CHUNK_SIZE
+from hash_cache import store_hash
+
+# 暂存目录中记录原始文件名的清单文件，每行一个 JSON 对象
+MANIFEST_NAME = 'manifest.jsonl'
+
+# 所有批次暂存目录的上级目录
+STAGING_ROOT = 'temp'
+
+# 允许的图片文件扩展名集合
+VALID_EXTENSIONS = {
+    'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'tif', 'webp', 'ico', 'heic', 'heif', 'jfif', 'pcx', 'ppm', 'pbm',
+    'psd'
+}
+
+
+# 检查上传文件名是否可接收，返回跳过的原因，可接收时返回 None
+def check_upload_name(filename):
+    # 检查是否为隐藏文件，隐藏文件名以点开头
+    if not filename or filename.startswith('.'):
+        return f"检查到隐藏文件“{filename}”，已跳过"
+    # 获取文件扩展名
+    if filename.split('.')[-1].lower() not in VALID_EXTENSIONS:
+        return f"检查到非图片文件“{filename}”，已跳过"
+    return None
+
+
+# 为一次上传生成批次 ID
+def new_batch_id():
+    return uuid.uuid4().hex
+
+
+# 获取批次的暂存目录（temp/<批次ID>），批次 ID 不合法时抛出 ValueError
+def get_staging_dir(batch_id):
+    if not re.fullmatch(r'[0-9a-f]{32}', batch_id or ''):
+        raise ValueError(f"Invalid batch id: {batch_id}")
+    return os.path.join(STAGING_ROOT, batch_id)
+
+
+# 暂存目录中的文件是否为上传内容（排除清单文件和未写完的临时文件）
+def is_staged_file(file_name):
+    return file_name != MANIFEST_NAME and not file_name.startswith('.')
+
+
+def save_upload(stream, folder, filename):
+    """
+    将上传的文件流分块写入暂存目录，写入的同时计算 SHA-256。
+
+    文件以内容哈希命名（<哈希值><扩展名>），原始文件名记录在清单中，
+    哈希值写入哈希缓存，后续阶段不需要再次读取文件计算哈希。
+
+    参数:
+        stream: 可读取的文件流。
+        folder (str): 暂存目录。
+        filename (str): 原始文件名。
+
+    返回:
+        tuple: (保存路径, 哈希值, 是否为新文件)；同一内容已在暂存目录中时不重复保存。
+    """
+    os.makedirs(folder, exist_ok=True)
+    hash_sha256 = hashlib.sha256()
+    fd, part_path = tempfile.mkstemp(prefix='.', suffix='.part', dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                hash_sha256.update(chunk)
+                f.write(chunk)
+        return commit_part(part_path, hash_sha256.hexdigest(), folder, filename)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+# 将写完的临时文件按哈希值命名并记录原始文件名
+def commit_part(part_path, digest, folder, filename):
+    ext = os.path.splitext(filename)[1].lower()
+    file_path = os.path.join(folder, f"{digest}{ext}")
+    if os.path.exists(file_path):
+        os.remove(part_path)
+        logging.info(f"暂存目录中已有相同内容的文件，已跳过: {filename}")
+        return file_path, digest, False
+
+    os.replace(part_path, file_path)
+    store_hash(file_path, digest)
+    with open(os.path.join(folder, MANIFEST_NAME), 'a', encoding='utf-8') as f:
+        f.write(json.dumps({"file": os.path.basename(file_path), "name": filename}, ensure_ascii=False) + '\n')
+    return file_path, digest, True
+
+
+# 读取暂存目录的清单，返回 {哈希文件名: 原始文件名}
+def read_manifest(folder):
+    names = {}
+    manifest_path = os.path.join(folder, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return names
+    with open(manifest_path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                names[entry["file"]] = entry["name"]
+    return names
+
+
+# 为同一批次内重名的文件生成不冲突的文件名（file.jpg、file_1.jpg、file_2.jpg ...）
+def unique_name(filename, used_names):
+    base_name, ext = os.path.splitext(filename)
+    counter = used_names.get(filename.lower(), 0)
+    candidate = filename
+    while candidate.lower() in used_names:
+        counter += 1
+        candidate = f"{base_name}_{counter}{ext}"
+    used_names[filename.lower()] = counter
+    used_names[candidate.lower()] = 0
+    return candidate
+
+
+# 暂存目录及其中文件的最后修改时间
+def _last_modified(staging_dir):
+    latest = os.path.getmtime(staging_dir)
+    for root, _, files in os.walk(staging_dir):
+        for file in files:
+            try:
+                latest = max(latest, os.path.getmtime(os.path.join(root, file)))
+            except FileNotFoundError:
+                pass
+    return latest
+
+
+def remove_expired_staging_dirs(max_age):
+    """
+    删除超过 max_age 秒没有写入的批次暂存目录。
+
+    放弃的分块上传会话、上传后未能提交入库任务的批次会一直留在 temp 中；
+    正常入库的批次在准备阶段就会删除自己的暂存目录，不受影响。
+
+    参数:
+        max_age (int): 暂存目录最后一次写入后的保留时间（秒）。
+
+    返回:
+        int: 删除的暂存目录数。
+    """
+    if not os.path.isdir(STAGING_ROOT):
+        return 0
+    deadline = time.time() - max_age
+    removed = 0
+    for name in os.listdir(STAGING_ROOT):
+        staging_dir = os.path.join(STAGING_ROOT, name)
+        if not re.fullmatch(r'[0-9a-f]{32}', name) or not os.path.isdir(staging_dir):
+            continue
+        try:
+            if _last_modified(staging_dir) >= deadline:
+                continue
+            shutil.rmtree(staging_dir)
+        except FileNotFoundError:
+            continue
+        except OSError as e:
+            logging.info(f"删除过期的暂存目录失败 {staging_dir}: {e}")
+            continue
+        removed += 1
+        logging.info(f"已删除过期的暂存目录: {staging_dir}")
+    return removed